@@ -11,17 +11,97 @@ __author__ = "Peter Portante (peter\x2Ea\x2Eportante\x40gmail\x2Ecom)"
 __copyright__ = "Copyright 2013 Peter Portante.  See LICENSE for details."
 __date__ = "2013/03/16"
 __version__ = "1.2.1"
-__usage__ = """Usage: pycscope.py [-D] [-R] [-S] [-V] [-f reffile] [-i srclistfile] [files ...]
+__usage__ = """Usage: pycscope.py [-D] [-R] [-S] [-V] [-f reffile] [-i srclistfile] [--graph=graphfile] [--sqlite=dbfile]
+                   [--ctags=tagsfile] [--etags=tagsfile] [--scopes=scopefile] [--prefetch=nthreads]
+                   [--disk-order] [--stats] [--layer=dist] [--layer-cache=dir]
+                   [--max-memory=size] [--relocatable] [--git] [--rev=revision] [--root=dir]
+                   [--includes=tablefile] [--include-root=dir] [--reproducible] [--progress]
+                   [--events=eventsfile] [--plugin=module] [--bloom] [--records] [files ...]
+       pycscope.py export [-S] [-f reffile] archive
+       pycscope.py import [-D] [-f reffile] archive
+       pycscope.py diff oldreffile newreffile
+       pycscope.py impact [-f reffile] [--include-root=dir] files ...
+       pycscope.py find [-f reffile] name
 
 -D              Dump the (C)oncrete (S)yntax (T)ree generated by the parser for each file
 -R              Recurse directories for files
 -S              Interpret simple strings as symbols
 -V              Print version and exit
 -f reffile      Use 'reffile' as cross-ref file name instead of 'cscope.out'
--i srclistfile  Use the contents of 'srclistfile' as the list of source files to scan"""
-
-import getopt, sys, os, string, re
-import keyword, parser, symbol, token
+-i srclistfile  Use the contents of 'srclistfile' as the list of source files to scan
+--graph=graphfile
+                Also write the call and import graph to 'graphfile' in a compact binary form
+--sqlite=dbfile Also store the files, lines and symbols in the SQLite database 'dbfile'
+--ctags=tagsfile
+                Also write the definitions found to the vi style tags file 'tagsfile'
+--etags=tagsfile
+                Also write the definitions found to the emacs style tags file 'tagsfile'
+--scopes=scopefile
+                Also write the fully qualified names of the definitions found to 'scopefile'
+--prefetch=nthreads
+                Read source files ahead of the parser using 'nthreads' threads
+--disk-order    Read source files in the order they are stored on disk
+--stats         Print statistics about the work done
+--layer=dist    Splice in the prebuilt index of the installed distribution 'dist', building
+                it first if needed; may be given more than once
+--layer-cache=dir
+                Keep the prebuilt indexes in 'dir' instead of '~/.cache/pycscope'
+--max-memory=size
+                Keep at most about 'size' bytes (e.g. 512M) of the index in memory, spilling
+                the rest to temporary files
+--relocatable   Write '.' as the directory of the index, so it can be used from another one
+--git           Record the git commit the index is built from, and on the next run only index
+                again the files git reports as changed since then
+--rev=revision  Index the files as they are in the git 'revision', read from the repository
+                rather than the work tree, only parsing the files not in the current index
+--root=dir      Index the files in 'dir' (the files given, or all, are looked for in it); may
+                be given more than once, the files then being named from the directory that
+                holds all the roots, which the index is made for
+--includes=tablefile
+                Also write the files each import resolves to, as tab separated lines of: file,
+                line number, module imported, and the files of the index it runs
+--include-root=dir
+                Look for the modules imported in 'dir' (relative to the directory of the index)
+                rather than in '.'; may be given more than once, for impact as well
+--reproducible  Write the same index, byte for byte, for the same files: directories are
+                searched in order of their names, and '.' is written as the directory of
+                the index
+--progress      Show the files done and left, the files and megabytes parsed per second and
+                the time left, when standard error is a terminal
+--events=eventsfile
+                Write a JSON object per line to 'eventsfile' ('-' for standard output) as each
+                file is started, finished, with its parse time and index size, or fails
+--plugin=module Run the analyses of the Python 'module' in the same pass: its register(visitors)
+                function adds its callbacks to the Visitors given, and returns its sinks, if any;
+                may be given more than once
+--bloom         Also write a Bloom filter of the symbols of each file to 'reffile'.bloom, so
+                that find only reads the files that may have the symbol looked for
+--records       Also record the hash of the contents each file is indexed from, and its
+                imports, in 'reffile'.files, for export to package those rather than the files
+                as they are, and for impact and --includes to read the imports of statements
+                continued over several lines
+
+export          Package the index, and a manifest of the files indexed, in the zip 'archive',
+                with the options it was built with, as recorded (--records), or else -S if given
+import          Unpack the index exported to 'archive' for the current directory, only
+                indexing again the files that differ from its manifest, with its options
+diff            Print the marked symbols added (+) and removed (-) from one index to the other,
+                by file, as tab separated lines of: +/-, name, mark, file, line number
+impact          Print the files of the index that import any of the 'files', directly or not,
+                and those files themselves, e.g. to select the tests to run after a change
+find            Print the lines of the index with the symbol 'name', as tab separated lines of:
+                file, line number, mark, text
+
+Files and directories named like a command are indexed when given after '--', or as
+e.g. './export'"""
+
+# Other modules are imported where they are needed, so that starting up
+# stays quick; see also loadGrammar()
+import sys, os
+try:
+    from _thread import allocate_lock
+except ImportError:
+    from thread import allocate_lock
 
 
 class Mark(object):
@@ -54,6 +134,11 @@ class Mark(object):
     def __ne__(self, other):
         return self.__mark != other.__mark
 
+    def char(self):
+        """ The mark character itself, or an empty string if none.
+        """
+        return self.__mark
+
     def format(self):
         """ Marks are represented as a string with a tab character
             followed by the mark character itself, if it has
@@ -79,23 +164,43 @@ class Mark(object):
 
 markFuncEnd = Mark(Mark.FUNC_END)
 
-# Get the list of Python keywords and add a few common builtins
-kwlist = keyword.kwlist
-kwlist.extend(("True", "False", "None"))
+# The parser modules, and the tables of the grammar further down, are only
+# loaded once a file is parsed (see loadGrammar())
+parser = symbol = token = None
+
+# The Python keywords and a few common builtins
+kwlist = None
 
 strings_as_symbols = False
 
+# Print the diagnostics of indexing to standard error, as the events go to
+# standard output (see diagnose())
+diagnose_to_stderr = False
+
 def main(argv=None):
     """Parse command line args and act accordingly.
     """
-    global strings_as_symbols
+    global strings_as_symbols, diagnose_to_stderr
 
     if argv is None:
         argv = sys.argv
 
+    # Commands other than indexing
+    if len(argv) > 1 and argv[1] in commands:
+        return commands[argv[1]](argv[1:])
+
+    if argv[1:] == ["-V"]:
+        # Asked often by editors, answer before loading getopt
+        print("pycscope.py: Version %s" % __version__)
+        return 0
+
     # Parse the command line arguments
+    import getopt
     try:
-        opts, args = getopt.getopt(argv[1:], "DRSVf:i:")
+        opts, args = getopt.getopt(argv[1:], "DRSVf:i:", ["graph=", "sqlite=", "ctags=", "etags=", "scopes=", "prefetch=", "disk-order", "stats",
+                                                          "layer=", "layer-cache=", "max-memory=", "relocatable", "git",
+                                                          "rev=", "root=", "includes=", "include-root=", "reproducible",
+                                                          "progress", "events=", "plugin=", "bloom", "records"])
     except getopt.GetoptError:
         print(__usage__)
         return 2
@@ -103,6 +208,25 @@ def main(argv=None):
     debug = False
     recurse = False
     indexfn = "cscope.out"
+    sinks = []
+    prefetch = 0
+    diskorder = False
+    stats = None
+    layers = []
+    layercache = os.path.join(os.path.expanduser("~"), ".cache", "pycscope")
+    maxmemory = None
+    relocatable = False
+    usegit = False
+    rev = None
+    roots = []
+    includesfn = None
+    includeroots = []
+    reproducible = False
+    progress = False
+    eventsfn = None
+    plugins = []
+    bloom = False
+    keeprecords = False
     for o, a in opts:
         if o == "-D":
             debug = True
@@ -117,7 +241,89 @@ def main(argv=None):
         if o == "-f":
             indexfn = a
         if o == "-i":
-            args.extend(list(map(string.rstrip, open(a, 'r').readlines())))
+            args.extend(list(map(str.rstrip, open(a, 'r').readlines())))
+        if o == "--graph":
+            sinks.append(GraphWriter(a))
+        if o == "--sqlite":
+            sinks.append(SqliteWriter(a))
+        if o == "--ctags":
+            sinks.append(TagsWriter(a))
+        if o == "--etags":
+            sinks.append(TagsWriter(a, emacs=True))
+        if o == "--scopes":
+            sinks.append(ScopeWriter(a))
+        if o == "--prefetch":
+            prefetch = int(a)
+        if o == "--disk-order":
+            diskorder = True
+        if o == "--stats":
+            stats = Stats()
+        if o == "--layer":
+            layers.append(a)
+        if o == "--layer-cache":
+            layercache = a
+        if o == "--max-memory":
+            try:
+                maxmemory = parseSize(a)
+            except ValueError:
+                print(__usage__)
+                return 2
+        if o == "--relocatable":
+            relocatable = True
+        if o == "--git":
+            usegit = True
+        if o == "--rev":
+            rev = a
+        if o == "--root":
+            roots.append(a)
+        if o == "--includes":
+            includesfn = a
+        if o == "--include-root":
+            includeroots.append(a)
+        if o == "--reproducible":
+            reproducible = relocatable = True
+        if o == "--progress":
+            progress = True
+        if o == "--events":
+            eventsfn = a
+        if o == "--plugin":
+            plugins.append(a)
+        if o == "--bloom":
+            bloom = True
+        if o == "--records":
+            keeprecords = True
+    diagnose_to_stderr = eventsfn == "-"
+
+    # Only one of --git, --rev and --root
+    if [usegit, rev is not None, bool(roots)].count(True) > 1:
+        print(__usage__)
+        return 2
+    for root in roots:
+        if not os.path.isdir(root):
+            print("pycscope.py: %s: No such directory" % root)
+            return 1
+
+    # Let the plugins register their callbacks, and add their sinks
+    visitors = None
+    if plugins:
+        import importlib
+        visitors = Visitors()
+        for name in plugins:
+            try:
+                module = importlib.import_module(name)
+            except ImportError as e:
+                diagnose("%s: %s" % (name, e))
+                return 1
+            sinks.extend(module.register(visitors) or [])
+
+    # Find the distributions to layer under the index before doing any work
+    dists = []
+    for name in layers:
+        dist = findDistribution(name)
+        if dist is None:
+            diagnose("%s: No such distribution installed" % name)
+            return 1
+        dists.append(dist)
 
     # Search current dir by default
     if len(args) == 0:
@@ -125,128 +331,2209 @@ def main(argv=None):
 
     # Parse the given list of files/dirs
     basepath = os.getcwd()
-    gen = genFiles(basepath, args, recurse)
+    indexpath = os.path.join(basepath, indexfn)
+
+    # Ask git which files changed since the index was built
+    state = changed = None
+    if usegit:
+        options = {"version": __version__, "args": list(args), "recurse": recurse,
+                   "strings": strings_as_symbols, "layers": layers, "reproducible": reproducible,
+                   "records": keeprecords}
+        state, changed = gitChanges(basepath, indexpath, options)
+        # Sinks need every file, and git can't see into archives or
+        # outside of the current directory
+        if changed is not None and (sinks or [name for name in args if isArchive(name) or isOutside(name)]):
+            changed = None
+
+    # Listeners to the progress of the work
+    events = []
+    if eventsfn is not None:
+        events.append(EventWriter(eventsfn))
+    meter = None
+    if progress and sys.stderr.isatty():
+        meter = Progress(sys.stderr)
+        events.append(meter)
+
+    blobs = None
+    records = None              # What the index doesn't keep about each file (see writeRecords())
+    if keeprecords:
+        records = {}
+    if rev is not None:
+        ret = revIndex(basepath, indexpath, rev, args, recurse, debug, sinks, prefetch, stats, events, visitors,
+                       records)
+        if ret is None:
+            diagnose("%s: Not a git revision" % rev)
+            return 1
+        indexbuff, fnamesbuff, blobs = ret
+    elif changed is not None:
+        indexbuff, fnamesbuff = updateIndex(basepath, indexpath, changed, args, recurse, debug, stats, reproducible,
+                                            events, records)
+    else:
+        if roots:
+            # Files are named from the directory holding all the roots
+            basepath = commonRoot(roots)
+            gen = genRoots(basepath, roots, args, recurse, reproducible)
+        else:
+            gen = genFiles(basepath, args, recurse, reproducible)
+        if meter is not None:
+            # Find all the files first, to tell how many are left
+            gen = list(gen)
+            meter.total = len(gen)
+        indexbuff, fnamesbuff = work(basepath, gen, debug, sinks, prefetch, diskorder, stats, maxmemory,
+                                     events=events, visitors=visitors, records=records)
+    for sink in sinks:
+        sink.close()
+    for listener in events:
+        listener.close()
+    if stats is not None:
+        print("pycscope.py: %s" % stats, file=sys.stderr)
+
+    # Splice in the prebuilt index of each distribution
+    for dist in dists:
+        sections, fnames = layerIndex(dist, layercache, debug)
+        indexbuff.extend(sections)
+        fnamesbuff.extend(fnames)
+
+    saveIndex(os.curdir if relocatable else basepath, indexpath, indexbuff, fnamesbuff)
+    if state is not None:
+        import json
+        state = json.dumps(state, sort_keys=True)
+    saveState(indexpath, ".git", state)
+    saveState(indexpath, ".blobs", blobs)
+    if records is not None:
+        writeRecords(indexpath, records)
+    else:
+        saveState(indexpath, ".files", None)
+    if bloom:
+        writeBloom(indexpath)
+    else:
+        saveState(indexpath, ".bloom", None)
 
-    indexbuff, fnamesbuff = work(basepath, gen, debug)
+    if includesfn is not None:
+        writeIncludes(indexpath, includesfn, includeroots or [os.curdir])
 
-    # Symbol data for the last file ends with a file mark
-    indexbuff.append("\n%s" % Mark(Mark.FILE))
+    return 0
 
-    if sys.hexversion < 0x03000000:
-        fout = open(os.path.join(basepath, indexfn), 'wb')
-    else:
-        fout = open(os.path.join(basepath, indexfn), 'w', newline='\n')
 
-    writeIndex(basepath, fout, indexbuff, fnamesbuff)
-    fout.close()
+def fileError(fname, e):
+    """Return the message of the error 'e' met with the file 'fname', as
+       "file: error".
+    """
+    if isinstance(e, EnvironmentError) and e.strerror:
+        return "%s: %s" % (e.filename or fname, e.strerror)
+    msg = e.args[0] if isinstance(e, KeyError) and e.args else str(e)
+    if msg.startswith("%s: " % fname):
+        return msg
+    return "%s: %s" % (fname, msg)
+
+
+def diagnose(message):
+    """Print a diagnostic of indexing, to standard output, or to standard
+       error when the events are written to standard output (--events=-).
+    """
+    print("pycscope.py: %s" % message, file=sys.stderr if diagnose_to_stderr else sys.stdout)
+
+
+def exportMain(argv):
+    """Parse the arguments of the export command and act accordingly.
+    """
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv[1:], "Sf:")
+    except getopt.GetoptError:
+        print(__usage__)
+        return 2
+    if len(args) != 1:
+        print(__usage__)
+        return 2
+
+    indexfn = "cscope.out"
+    strings = False
+    for o, a in opts:
+        if o == "-S":
+            strings = True
+        if o == "-f":
+            indexfn = a
+
+    basepath = os.getcwd()
+    indexpath = os.path.join(basepath, indexfn)
+    try:
+        exportIndex(basepath, indexpath, args[0], strings)
+    except (IOError, OSError, ValueError) as e:
+        print("pycscope.py: %s" % fileError(indexpath, e))
+        return 1
+    return 0
+
+
+def importMain(argv):
+    """Parse the arguments of the import command and act accordingly.
+    """
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv[1:], "Df:")
+    except getopt.GetoptError:
+        print(__usage__)
+        return 2
+    if len(args) != 1:
+        print(__usage__)
+        return 2
+
+    debug = False
+    indexfn = "cscope.out"
+    for o, a in opts:
+        if o == "-D":
+            debug = True
+        if o == "-f":
+            indexfn = a
+
+    import zipfile
+    basepath = os.getcwd()
+    try:
+        importIndex(basepath, args[0], os.path.join(basepath, indexfn), debug)
+    except (IOError, OSError, ValueError, KeyError, zipfile.BadZipfile) as e:
+        print("pycscope.py: %s" % fileError(args[0], e))
+        return 1
+    return 0
+
+
+def hashFile(basepath, relpath):
+    """Return the hash of the contents of a source file, as work() computes
+       it, or None if it can't be read.
+    """
+    import hashlib
+    try:
+        data = readData(basepath, relpath)
+    except (IOError, OSError):
+        return None
+    return hashlib.sha1(data).hexdigest()
+
+
+def modifiedTime(basepath, relpath):
+    """Return the modification time of a source file, that of the archive
+       for a member of one, or None if it is gone.
+    """
+    archive, member = splitArchivePath(basepath, relpath)
+    try:
+        return os.stat(os.path.join(basepath, archive or relpath)).st_mtime
+    except OSError:
+        return None
+
+
+def exportIndex(basepath, indexfn, archivefn, strings=False):
+    """ Package the index 'indexfn', of the files under 'basepath', in the
+        zip archive 'archivefn', along with a manifest of the hashes of the
+        contents the files were indexed from (see importIndex()), as
+        recorded when indexing them (see writeRecords()). Files with no
+        such record are hashed as they are, unless changed since the index
+        was written; those are left out of the manifest, so that they are
+        indexed again on import.
+
+        The options the index was built with (see buildOptions()) are
+        packaged too: those recorded with it, or else those of this
+        process, with 'strings' for -S.
+
+        The index is made relocatable: its directory is written as '.'.
+    """
+    import zipfile, tempfile, json
+    hdr_basepath, sections, fnames = readIndex(indexfn)
+    records = readRecords(indexfn)
+    options = readOptions(indexfn) or dict(buildOptions(), strings=strings)
+    written = os.stat(indexfn).st_mtime
+    manifest = []
+    kept = {}
+    for fname, section in sections:
+        record = sectionRecord(records, fname, section)
+        if record is not None:
+            digest = record["sha1"]
+            kept[fname] = record
+        else:
+            mtime = modifiedTime(basepath, fname)
+            digest = hashFile(basepath, fname) if mtime is not None and mtime < written else None
+        if digest is not None:
+            manifest.append("%s  %s\n" % (digest, fname))
+
+    fd, tmpfn = tempfile.mkstemp(prefix='pycscope')
+    os.close(fd)
+    try:
+        saveIndex(os.curdir, tmpfn, [section for fname, section in sections], fnames)
+        with zipfile.ZipFile(archivefn, 'w', zipfile.ZIP_DEFLATED) as z:
+            z.write(tmpfn, "cscope.out")
+            z.writestr("MANIFEST", _encode(''.join(manifest)))
+            z.writestr("OPTIONS", _encode(json.dumps(options, sort_keys=True)))
+            if kept:
+                z.writestr("RECORDS", _encode(json.dumps({"files": kept}, sort_keys=True)))
+    finally:
+        os.remove(tmpfn)
+
+
+def importIndex(basepath, archivefn, indexfn, debug=False):
+    """ Write the index packaged in the zip archive 'archivefn' (see
+        exportIndex()) to 'indexfn', for the files under 'basepath'.
+
+        The sections of the files whose contents match the hashes of the
+        manifest are used as they are. The files that differ are indexed
+        again, with the -S option of the index, and those that are gone are
+        left out. All the files are indexed again if the index was built by
+        another version of pycscope or of Python, whose sections may differ.
+
+        Returns the list of files indexed again.
+    """
+    global strings_as_symbols
+    import zipfile, json
+    with zipfile.ZipFile(archivefn) as z:
+        data = z.read("cscope.out")
+        manifest = z.read("MANIFEST")
+        try:
+            previous = json.loads(z.read("RECORDS").decode('utf-8'))["files"]
+        except KeyError:
+            # Exported without records
+            previous = None
+        try:
+            options = json.loads(z.read("OPTIONS").decode('utf-8'))
+        except KeyError:
+            # Made with options unknown
+            options = {}
+    if sys.hexversion >= 0x03000000:
+        manifest = manifest.decode('utf-8')
+    hdr_basepath, sections, fnames = parseIndex(data, archivefn)
+
+    digests = {}
+    for line in manifest.splitlines():
+        digest, fname = line.split("  ", 1)
+        digests[fname] = digest
+    fnames = set(fnames)
+
+    # Sections are only reused when made the same way they would be here
+    current = buildOptions()
+    reuse = all(options.get(name) == current[name] for name in ("version", "python"))
+
+    indexbuff = []
+    fnamesbuff = []
+    changed = []
+    records = None if previous is None else {}
+    orig_strings = strings_as_symbols
+    strings_as_symbols = bool(options.get("strings", strings_as_symbols))
+    try:
+        for fname, section in sections:
+            digest = hashFile(basepath, fname)
+            if digest is None:
+                # Gone
+                continue
+            if reuse and digest == digests.get(fname):
+                indexbuff.append(section)
+                if fname in fnames:
+                    fnamesbuff.append(fname)
+            else:
+                changed.append(fname)
+                section, names = work(basepath, [fname], debug, records=records)
+                indexbuff.extend(section)
+                fnamesbuff.extend(names)
+
+        saveIndex(basepath, indexfn, indexbuff, fnamesbuff)
+        if records is not None:
+            writeRecords(indexfn, records, previous)
+        else:
+            saveState(indexfn, ".files", None)
+    finally:
+        strings_as_symbols = orig_strings
+    saveState(indexfn, ".git", None)
+    saveState(indexfn, ".blobs", None)
+    saveState(indexfn, ".bloom", None)
+    return changed
+
+
+def diffMain(argv):
+    """Parse the arguments of the diff command and act accordingly.
+
+       Like diff(1), returns 1 when the indexes differ, and 2 when one
+       can't be read.
+    """
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv[1:], "")
+    except getopt.GetoptError:
+        print(__usage__)
+        return 2
+    if len(args) != 2:
+        print(__usage__)
+        return 2
+
+    differ = False
+    try:
+        for sign, name, mark, fname, lineno in diffIndexes(args[0], args[1]):
+            print("%s\t%s\t%s\t%s\t%d" % (sign, name, mark, fname, lineno))
+            differ = True
+    except (IOError, OSError) as e:
+        print("pycscope.py: %s" % fileError(args[0], e))
+        return 2
+    except ValueError as e:
+        # Names the index
+        print("pycscope.py: %s" % e)
+        return 2
+    return 1 if differ else 0
+
+
+def diffIndexes(oldfn, newfn):
+    """ Generator over the marked symbols added to and removed from the
+        index 'oldfn' in the index 'newfn', yielding a (sign, name, mark,
+        file, line number) tuple for each, the sign being '+' or '-'. The
+        differences are given file by file, in the order of 'newfn', then
+        for the files only in 'oldfn'.
+
+        Both indexes are read a section at a time (see iterSections()).
+        Only the offset and hash of each section of 'oldfn' is kept, and
+        the sections whose bytes are the same in both are skipped.
+    """
+    import hashlib
+    with open(oldfn, 'rb') as old:
+        oldsections = {}        # File name to (offset, size, hash) of its section
+        oldorder = []
+        for fname, offset, section in iterSections(old, oldfn):
+            oldsections[fname] = (offset, len(section), hashlib.sha1(section).digest())
+            oldorder.append(fname)
+
+        with open(newfn, 'rb') as new:
+            for fname, offset, section in iterSections(new, newfn):
+                entry = oldsections.pop(fname, None)
+                if entry is not None and entry[2] == hashlib.sha1(section).digest():
+                    continue
+                for diff in diffSections(fname, readSection(old, entry), section):
+                    yield diff
+
+        for fname in oldorder:
+            if fname in oldsections:
+                for diff in diffSections(fname, readSection(old, oldsections[fname]), b""):
+                    yield diff
+
+
+def readSection(fin, entry):
+    # Read the section at the (offset, size, ...) given, if any
+    if entry is None:
+        return b""
+    fin.seek(entry[0])
+    return fin.read(entry[1])
+
+
+def diffSections(fname, oldsection, newsection):
+    """ Generator over the marked symbols added to and removed from the
+        section 'oldsection' in the section 'newsection' of the file
+        'fname' (see diffIndexes()). Symbols are matched by name and mark,
+        as their line numbers change with any edit above them.
+    """
+    old = sectionSymbols(oldsection)
+    new = sectionSymbols(newsection)
+    for sign, these, others in (('-', old, new), ('+', new, old)):
+        counts = {}
+        for mark, name, lineno in others:
+            counts[mark, name] = counts.get((mark, name), 0) + 1
+        for mark, name, lineno in these:
+            if counts.get((mark, name)):
+                counts[mark, name] -= 1
+            else:
+                yield sign, name, mark, fname, lineno
+
+
+def sectionSymbols(section):
+    # Return the (mark, name, lineno) marked symbols of a section, as bytes
+    if sys.hexversion >= 0x03000000:
+        section = section.decode('utf-8')
+    symbols = []
+    for lineno, text, marks in iterIndexLines(section.split("\n")):
+        for mark, name in marks:
+            if mark and name:
+                symbols.append((mark, name, lineno))
+    return symbols
+
+
+def findMain(argv):
+    """Parse the arguments of the find command and act accordingly.
+    """
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv[1:], "f:")
+    except getopt.GetoptError:
+        print(__usage__)
+        return 2
+    if len(args) != 1:
+        print(__usage__)
+        return 2
+
+    indexfn = "cscope.out"
+    for o, a in opts:
+        if o == "-f":
+            indexfn = a
 
+    try:
+        for fname, lineno, mark, text in findSymbol(indexfn, args[0]):
+            print("%s\t%d\t%s\t%s" % (fname, lineno, mark, text))
+    except (IOError, OSError, ValueError) as e:
+        print("pycscope.py: %s" % fileError(indexfn, e))
+        return 1
     return 0
 
 
+def impactMain(argv):
+    """Parse the arguments of the impact command and act accordingly.
+    """
+    import getopt
+    try:
+        opts, args = getopt.getopt(argv[1:], "f:", ["include-root="])
+    except getopt.GetoptError:
+        print(__usage__)
+        return 2
+    if not args:
+        print(__usage__)
+        return 2
+
+    indexfn = "cscope.out"
+    includeroots = []
+    for o, a in opts:
+        if o == "-f":
+            indexfn = a
+        if o == "--include-root":
+            includeroots.append(a)
+
+    try:
+        graph = importGraph(indexfn, includeroots or [os.curdir])
+    except (IOError, OSError, ValueError) as e:
+        print("pycscope.py: %s" % fileError(indexfn, e))
+        return 1
+    for fname in impactedFiles(graph, args):
+        print(fname)
+    return 0
+
+
+def importGraph(indexfn, roots=(os.curdir,)):
+    """ Return the reverse import graph of the files of the index 'indexfn',
+        as a dictionary of each file to the list of the files importing it.
+
+        The imports of each file are resolved to the files of the index they
+        run (see resolveIncludes()). The graph is cached in 'indexfn'.impact,
+        and only built again when the index (see bloomStamp()), its records
+        or the 'roots' change.
+    """
+    import json, binascii
+    size, mtime, digest = bloomStamp(indexfn)
+    key = [size, mtime, binascii.hexlify(digest).decode('ascii')]
+    try:
+        st = os.stat(indexfn + ".files")
+        key.extend([st.st_size, getattr(st, 'st_mtime_ns', None) or int(st.st_mtime * 1000000000)])
+    except OSError:
+        key.extend([None, None])
+    roots = list(roots)
+    try:
+        with open(indexfn + ".impact") as f:
+            cached = json.load(f)
+        if cached["index"] == key and cached["roots"] == roots:
+            files = cached["files"]
+            return dict((files[i], [files[j] for j in importers])
+                        for i, importers in enumerate(cached["importers"]))
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        pass
+
+    importers = dict((fname, set()) for fname in readTrailer(indexfn))
+    for fname, lineno, include, imported in resolveIncludes(indexfn, roots):
+        for ifname in imported:
+            if ifname != fname:
+                importers[ifname].add(fname)
+
+    files = sorted(importers)
+    ids = dict((fname, i) for i, fname in enumerate(files))
+    importers = [sorted(ids[i] for i in importers[fname]) for fname in files]
+    cached = {"index": key, "roots": roots, "files": files, "importers": importers}
+    try:
+        with open(indexfn + ".impact", "w") as f:
+            json.dump(cached, f)
+    except (IOError, OSError):
+        # Built again next time
+        pass
+    return dict((files[i], [files[j] for j in importers[i]]) for i in range(len(files)))
+
+
+def writeIncludes(indexfn, tablefn, roots=(os.curdir,)):
+    """ Write the imports of the files of the index 'indexfn', and the files
+        they resolve to (see resolveIncludes()), to the table 'tablefn' as
+        tab separated lines of: file, line number, module as imported, and
+        the files imported, if any, in that order.
+    """
+    with open(tablefn, 'wb') as fout:
+        for fname, lineno, include, imported in resolveIncludes(indexfn, roots):
+            fout.write(_encode("\t".join([fname, str(lineno), include] + imported) + "\n"))
+
+
+def readIncludes(tablefn):
+    """ Read a table written by writeIncludes(), returning a dictionary of
+        each file imported to the list of (file, line number) importing it.
+    """
+    includers = {}
+    with open(tablefn, 'rb') as fin:
+        for line in fin.read().splitlines():
+            if sys.hexversion >= 0x03000000:
+                line = line.decode('utf-8')
+            row = line.split("\t")
+            for fname in row[3:]:
+                includers.setdefault(fname, []).append((row[0], int(row[1])))
+    return includers
+
+
+def resolveIncludes(indexfn, roots=(os.curdir,)):
+    """ Generator over the imports of the files of the index 'indexfn',
+        yielding a (file, line number, include, files) tuple for each
+        module imported. The include is the module as imported, with the
+        leading dots of relative imports, and the files are those of the
+        index the import runs (see resolveImport()).
+
+        Modules are named from each of the directories 'roots', relative to
+        the directory of the index or absolute, in turn: with 'src' a root,
+        src/pkg/mod.py is pkg.mod. The package of a file, for its relative
+        imports, is that of the first root it is under.
+
+        The import statements of a file are those of its record, if the
+        index has one for it (see writeRecords()); otherwise they are read
+        from the lines of the index, which miss the names of statements
+        continued over several lines.
+    """
+    modules = {}                # Module name to the file providing it
+    packages = {}               # File name to the parts of the name of its package
+    fnames = readTrailer(indexfn)
+    for root in roots:
+        root = os.path.normpath(root)
+        for fname in fnames:
+            path = os.path.normpath(fname)
+            if root != os.curdir:
+                if not path.startswith(root + os.sep):
+                    continue
+                path = path[len(root) + 1:]
+            elif isOutside(path):
+                continue
+            name = moduleName(path)
+            modules.setdefault(name, fname)
+            if fname not in packages:
+                parts = name.split('.')
+                if os.path.basename(path) != '__init__.py':
+                    parts.pop()
+                packages[fname] = parts
+
+    records = readRecords(indexfn)
+    with open(indexfn, 'rb') as fin:
+        for fname, offset, section in iterSections(fin, indexfn):
+            record = sectionRecord(records, fname, section)
+            if record is not None and "imports" in record:
+                imports = record["imports"]
+            else:
+                imports = []
+                if sys.hexversion >= 0x03000000:
+                    section = section.decode('utf-8')
+                for lineno, text, symbols in iterIndexLines(section.split("\n")):
+                    if "import" in text:
+                        imports.extend((lineno,) + stmt for stmt in parseImports(text))
+            for lineno, level, module, names in imports:
+                imported = resolveImport(modules, packages.get(fname), level, module, names)
+                yield fname, lineno, '.' * level + module, imported
+
+
+def parseImports(text):
+    """ Return the (level, module, names) of each import statement on the
+        text of a line of the index, the level being the number of leading
+        dots of a relative import, and the names those imported from the
+        module by from ... import ... statements.
+    """
+    imports = []
+    stmt = []
+    for tok in text.split() + [';']:
+        if tok == ':':
+            # The body of a compound statement on the same line
+            stmt = []
+        elif tok != ';':
+            stmt.append(tok)
+        elif stmt[:1] == ['import']:
+            for name in ' '.join(stmt[1:]).split(','):
+                if name.split():
+                    imports.append((0, name.split()[0], []))
+            stmt = []
+        elif stmt[:1] == ['from'] and 'import' in stmt:
+            idx = stmt.index('import')
+            level = sum(len(tok) for tok in stmt[1:idx] if not tok.strip('.'))
+            module = ''.join(tok for tok in stmt[1:idx] if tok.strip('.'))
+            names = [name.split()[0] for name in ' '.join(stmt[idx + 1:]).strip('() ').split(',')
+                     if name.split()]
+            imports.append((level, module, names))
+            stmt = []
+        else:
+            stmt = []
+    return imports
+
+
+def resolveImport(modules, package, level, module, names=()):
+    """ Return the files, from the dictionary 'modules' of module names to
+        files, that an import runs: those of the module and the packages it
+        is in (see resolveInclude()), and of the submodules among the
+        'names' imported from it. Relative imports, of the given 'level',
+        are resolved from 'package', the parts of the name of the package
+        of the importing file, if known.
+    """
+    if level:
+        if package is None or level > len(package):
+            return []
+        parts = package[:len(package) - level + 1]
+        if module:
+            parts = parts + [module]
+    else:
+        parts = [module]
+    fnames = resolveInclude(modules, '.'.join(parts)) if parts else []
+    for name in names:
+        fname = modules.get('.'.join(parts + [name]))
+        if fname is not None and fname not in fnames:
+            fnames.append(fname)
+    return fnames
+
+
+def resolveInclude(modules, name):
+    """ Return the files, from the dictionary 'modules' of module names to
+        files, that importing the dotted module 'name' runs: those of the
+        module and of the packages it is in.
+    """
+    parts = name.split('.')
+    fnames = []
+    for i in range(1, len(parts) + 1):
+        fname = modules.get('.'.join(parts[:i]))
+        if fname is not None:
+            fnames.append(fname)
+    return fnames
+
+
+def impactedFiles(graph, changed):
+    """ Return the files of the reverse import 'graph' (see importGraph())
+        importing any of the files 'changed', directly or not, and those of
+        the files 'changed' in the graph, in order of their names.
+    """
+    names = dict((os.path.normpath(fname), fname) for fname in graph)
+    todo = [names[path] for path in map(os.path.normpath, changed) if path in names]
+    seen = set(todo)
+    while todo:
+        for importer in graph[todo.pop()]:
+            if importer not in seen:
+                seen.add(importer)
+                todo.append(importer)
+    return sorted(seen)
+
+
+def runGit(basepath, *args):
+    """Run git with the given arguments in 'basepath', returning the list of
+       NUL separated names it prints, or None if it fails.
+    """
+    import subprocess
+    try:
+        proc = subprocess.Popen(("git",) + args, cwd=basepath,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    out, err = proc.communicate()
+    if proc.returncode != 0:
+        return None
+    if sys.hexversion >= 0x03000000:
+        out = os.fsdecode(out)
+    return [name for name in out.split("\0") if name]
+
+
+def gitChanges(basepath, indexfn, options):
+    """ Ask git which files under 'basepath' changed since the index
+        'indexfn' was built, per the state recorded along with it, in
+        'indexfn'.git, by the previous run.
+
+        Returns the state to record for this run, or None if 'basepath'
+        is not in a git work tree, and the set of files changed, as
+        normalized paths relative to 'basepath'. Those are the files that
+        differ from the commit recorded, the untracked files, and those
+        that were either when the index was built. The files changed are
+        None when the index must be built in full: when there is no index
+        or state, or when 'options', those the index is built with, differ
+        from those recorded.
+
+        Both are found from the git index, without reading every file.
+        Files ignored by git are not seen to change.
+    """
+    import json
+    head = runGit(basepath, "rev-parse", "HEAD")
+    dirty = runGit(basepath, "diff", "--name-only", "--relative", "--no-renames", "-z", "HEAD")
+    untracked = runGit(basepath, "ls-files", "--others", "--exclude-standard", "-z")
+    if head is None or dirty is None or untracked is None:
+        return None, None
+    state = dict(options, commit=head[0].strip(),
+                 dirty=sorted(set(os.path.normpath(path) for path in dirty + untracked)))
+
+    try:
+        with open(indexfn + ".git") as f:
+            old = json.load(f)
+    except (IOError, OSError, ValueError):
+        return state, None
+    if not os.path.isfile(indexfn) or [key for key in options if old.get(key) != options[key]]:
+        return state, None
+    changed = runGit(basepath, "diff", "--name-only", "--relative", "--no-renames", "-z", old["commit"])
+    if changed is None:
+        # The commit is gone
+        return state, None
+    changed = set(os.path.normpath(path) for path in changed)
+    return state, changed.union(state["dirty"], old["dirty"])
+
+
+def isOutside(name):
+    # Is this path outside of the current directory?
+    return os.path.isabs(name) or os.path.normpath(name).split(os.sep)[0] == os.pardir
+
+
+def argsName(args, recurse, path):
+    """ Return the name genFiles() gives the Python source file 'path', a
+        normalized path, when given 'args', or None if they don't select it.
+    """
+    for name in args:
+        norm = os.path.normpath(name)
+        if isArchive(norm):
+            if path.startswith(norm + os.sep):
+                return "%s/%s" % (name, path[len(norm) + 1:])
+            continue
+        if path == norm:
+            if isPython(name):
+                return name
+            continue
+        if norm == os.curdir:
+            rest = path
+        elif path.startswith(norm + os.sep):
+            rest = path[len(norm) + 1:]
+        else:
+            continue
+        if isPython(rest) and (recurse or os.sep not in rest):
+            return os.path.join(name, rest)
+    return None
+
+
+def updateIndex(basepath, indexfn, changed, args, recurse, debug, stats=None, sort=False, events=(), records=None):
+    """ Return the index buffer and file names of the index 'indexfn', of
+        the files under 'basepath', brought up to date by indexing again
+        only the files in 'changed' (see gitChanges()).
+
+        The sections of the other files selected by 'args' are reused as
+        they are, in the same order, and those of the files changed that
+        are gone are left out. New files are added at the end, in order.
+        Sections of files not selected, such as those of layers, are left
+        out too. With 'sort' set, the sections are all put in the order
+        genFiles() returns them when sorting. The files indexed again are
+        reported to 'events', and recorded in 'records' (see work()).
+    """
+    hdr_basepath, sections, fnames = readIndex(indexfn)
+    fnames = set(fnames)
+
+    entries = []                # (file name, section, trailer names) of each file
+    seen = set()
+    for fname, section in sections:
+        path = os.path.normpath(fname)
+        if argsName(args, recurse, path) != fname:
+            continue
+        seen.add(path)
+        if path not in changed:
+            entries.append((fname, [section], [fname] if fname in fnames else []))
+        elif os.path.isfile(os.path.join(basepath, path)):
+            section, names = work(basepath, [fname], debug, stats=stats, events=events, records=records)
+            entries.append((fname, section, names))
+
+    for path in sorted(changed.difference(seen)):
+        fname = argsName(args, recurse, path)
+        if fname is not None and os.path.isfile(os.path.join(basepath, path)):
+            section, names = work(basepath, [fname], debug, stats=stats, events=events, records=records)
+            entries.append((fname, section, names))
+
+    if sort:
+        # Directory by directory, as parseDir() goes
+        entries.sort(key=lambda entry: entry[0].split(os.sep))
+    indexbuff = []
+    fnamesbuff = []
+    for fname, section, names in entries:
+        indexbuff.extend(section)
+        fnamesbuff.extend(names)
+    return indexbuff, fnamesbuff
+
+
+def saveState(indexfn, suffix, state):
+    """Record the string 'state', about how the index 'indexfn' was built,
+       in 'indexfn' + 'suffix', or remove any recorded there if it is None.
+    """
+    path = indexfn + suffix
+    if state is not None:
+        with open(path, "w") as f:
+            f.write(state)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def writeRecords(indexfn, records, previous=None):
+    """ Record what the index 'indexfn' doesn't keep about each of its
+        files, such as the hash of the contents it was indexed from, in
+        'indexfn'.files, along with the hash of the section of the file, so
+        that a record is only used with the section it was made for (see
+        sectionRecord()).
+
+        'records' holds those of the files just indexed, by file name (see
+        work()). The records of the other files are kept from 'previous',
+        by default those of the index before, for the sections that are
+        the same.
+    """
+    import hashlib, json
+    if previous is None:
+        previous = readRecords(indexfn)
+    files = {}
+    with open(indexfn, 'rb') as fin:
+        for fname, offset, section in iterSections(fin, indexfn):
+            digest = hashlib.sha1(section).hexdigest()
+            record = records.get(fname)
+            if record is None:
+                record = previous.get(fname)
+                if record is None or record.get("section") != digest:
+                    continue
+            files[fname] = dict(record, section=digest)
+    saveState(indexfn, ".files", json.dumps({"files": files, "options": buildOptions()}, sort_keys=True))
+
+
+def readRecords(indexfn):
+    """ Return the records of the files of the index 'indexfn', by file
+        name (see writeRecords()), or none if it has none.
+    """
+    import json
+    try:
+        with open(indexfn + ".files") as f:
+            return json.load(f)["files"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def readOptions(indexfn):
+    """ Return the options the index 'indexfn' was built with (see
+        buildOptions()), as recorded with its records, or None if not.
+    """
+    import json
+    try:
+        with open(indexfn + ".files") as f:
+            return json.load(f)["options"]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def buildOptions():
+    """ Return the options the sections of an index are made with, here:
+        the versions of pycscope and Python, and -S.
+    """
+    return {"version": __version__, "strings": strings_as_symbols, "python": list(sys.version_info[:2])}
+
+
+def sectionRecord(records, fname, section):
+    # The record of the file, if made for this very section of the index
+    import hashlib
+    record = records.get(fname)
+    if record is not None and record.get("section") == hashlib.sha1(_encode(section)).hexdigest():
+        return record
+    return None
+
+
+class GitBlobs(object):
+    """ Reads files, as they are in a git revision, from the object store
+        of the repository 'basepath' is in, through a single 'git cat-file
+        --batch' process, given the SHA of the blob of each file.
+    """
+    def __init__(self, basepath, shas):
+        import subprocess
+        self.shas = shas            # File name to the SHA of its blob
+        self.lock = allocate_lock()
+        self.proc = subprocess.Popen(["git", "cat-file", "--batch"], cwd=basepath,
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read(self, basepath, relpath):
+        ''' Return the bytes of a file, like readData()
+        '''
+        sha = self.shas[relpath]
+        with self.lock:
+            self.proc.stdin.write(_encode(sha + "\n"))
+            self.proc.stdin.flush()
+            # The blob is "<sha> blob <size>\n<contents>\n"
+            hdr = self.proc.stdout.readline().split()
+            if len(hdr) != 3 or hdr[1] != b"blob":
+                raise IOError("%s: No such blob: %s" % (relpath, sha))
+            return self.proc.stdout.read(int(hdr[2]) + 1)[:-1]
+
+    def close(self):
+        ''' Stop the git process
+        '''
+        self.proc.stdin.close()
+        self.proc.wait()
+        self.proc.stdout.close()
+
+
+def revIndex(basepath, indexfn, rev, args, recurse, debug, sinks=(), prefetch=0, stats=None, events=(),
+             visitors=None, records=None):
+    """ Index the files selected by 'args' (see argsName()) as they are in
+        the git revision 'rev' of the repository 'basepath' is in. They are
+        read from the object store (see GitBlobs), not from the work tree.
+
+        The SHA of the blob of each file is the key to its section: the
+        sections of the blobs already in the index 'indexfn', of whichever
+        revision, are reused from it, so that only the blobs that differ
+        are parsed. Unless 'sinks' are given, as those need every file, or
+        the sections were made with other options, as those change them.
+        The blobs parsed are recorded in 'records' (see work()).
+
+        Returns the index buffer and file names, as work() does, and the
+        manifest of the blobs indexed, as JSON with the SHA of each by file
+        name and the options, to record in 'indexfn'.blobs for the next
+        run. Returns None if 'rev' is not a revision.
+    """
+    import json
+    entries = runGit(basepath, "ls-tree", "-r", "-z", rev)
+    if entries is None:
+        return None
+    shas = {}
+    fnames = []
+    for entry in entries:
+        # "<mode> <type> <sha>\t<path>", links and submodules left out
+        info, path = entry.split("\t", 1)
+        mode, kind, sha = info.split()
+        fname = argsName(args, recurse, os.path.normpath(path))
+        if kind == "blob" and mode != "120000" and fname is not None:
+            shas[fname] = sha
+            fnames.append(fname)
+
+    # Section bodies, after the file mark, of the blobs already indexed
+    options = buildOptions()
+    cache = {}
+    if not sinks:
+        try:
+            with open(indexfn + ".blobs") as f:
+                state = json.load(f)
+            if state.get("options") != options:
+                raise ValueError("%s.blobs: Made with other options" % indexfn)
+            digests = state["blobs"]
+            hdr_basepath, sections, oldfnames = readIndex(indexfn)
+        except (IOError, OSError, ValueError, KeyError, TypeError, AttributeError):
+            sections = []
+        for fname, section in sections:
+            if fname in digests:
+                cache[digests[fname]] = section[len(formatFileMark(fname)):]
+
+    # Parse the other blobs, then split the section of each out
+    blobs = GitBlobs(basepath, shas)
+    try:
+        parsebuff, parsednames = work(basepath, [fname for fname in fnames if shas[fname] not in cache],
+                                      debug, sinks, prefetch, stats=stats, read=blobs.read, events=events,
+                                      visitors=visitors, records=records)
+    finally:
+        blobs.close()
+    marks = dict((formatFileMark(fname), fname) for fname in parsednames)
+    parsed = {}
+    for piece in parsebuff:
+        if piece in marks:
+            section = parsed[marks[piece]] = []
+        section.append(piece)
+
+    indexbuff = []
+    fnamesbuff = []
+    manifest = {}
+    for fname in fnames:
+        sha = shas[fname]
+        if sha in cache:
+            indexbuff.append(formatFileMark(fname))
+            indexbuff.append(cache[sha])
+        elif fname in parsed:
+            indexbuff.extend(parsed[fname])
+        else:
+            continue
+        fnamesbuff.append(fname)
+        manifest[fname] = sha
+    return indexbuff, fnamesbuff, json.dumps({"options": options, "blobs": manifest}, sort_keys=True)
+
+
+def parseSize(text):
+    """Return the number of bytes of a size such as 512, 64K, 100M or 2G.
+    """
+    text = text.strip().upper()
+    scale = 1
+    if text[-1:] in ("K", "M", "G"):
+        scale = 1024 ** ("KMG".index(text[-1]) + 1)
+        text = text[:-1]
+    size = int(text) * scale
+    if size <= 0:
+        raise ValueError("Size must be positive: %s" % text)
+    return size
+
+
+def saveIndex(basepath, indexfn, indexbuff, fnamesbuff):
+    """Write the index buffer, as returned by work(), to the file 'indexfn'.
+    """
+    # Symbol data for the last file ends with a file mark
+    indexbuff.append("\n%s" % Mark(Mark.FILE))
+
+    with open(indexfn, 'wb') as fout:
+        writeIndex(basepath, fout, indexbuff, fnamesbuff)
+
+
 def writeIndex(basepath, fout, indexbuff, fnamesbuff):
-    """Write the index buffer to the output file.
+    """Write the index buffer to the output file, which must be binary.
+
+       The index is encoded and written a block at a time (see
+       encodeBlocks()), never as a whole, and the offset of the trailer,
+       in bytes, is filled in the header once the index is written.
     """
+    hdr = _encode("cscope 15 %s -c " % basepath)
+    if isinstance(indexbuff, IndexBuffer):
+        # Already encoded, streamed back from disk a piece at a time
+        blocks = indexbuff
+        index_len = indexbuff.length
+    else:
+        blocks = encodeBlocks(indexbuff)
+        index_len = None
+        try:
+            start = fout.tell()
+        except (IOError, OSError):
+            # Can't go back to the header, encode the whole index first
+            blocks = list(blocks)
+            index_len = sum(len(block) for block in blocks)
+
     # Write the header and index
-    index = ''.join(indexbuff)
-    index_len = len(index)
-    hdr_len = len(basepath) + 25
-    fout.write("cscope 15 %s -c %010d" % (basepath, hdr_len + index_len))
-    fout.write(index)
+    fout.write(hdr + _encode("%010d" % (len(hdr) + 11 + (index_len or 0))))
+    written = 0
+    for block in blocks:
+        fout.write(block)
+        written += len(block)
+    if index_len is None:
+        end = fout.tell()
+        fout.seek(start + len(hdr))
+        fout.write(_encode("%010d" % (len(hdr) + 11 + written)))
+        fout.seek(end)
 
     # Write trailer info
-    fnames = '\n'.join(fnamesbuff) + '\n'
-    fout.write("\n1\n.\n0\n")
-    fout.write("%d\n" % len(fnamesbuff))
-    fout.write("%d\n" % len(fnames))
+    fnames = _encode('\n'.join(fnamesbuff) + '\n')
+    fout.write(_encode("\n1\n.\n0\n%d\n%d\n" % (len(fnamesbuff), len(fnames))))
     fout.write(fnames)
 
 
-def work(basepath, gen, debug):
+def encodeBlocks(pieces, count=4096):
+    """ Return the strings 'pieces' joined and encoded 'count' at a time.
+    """
+    for i in range(0, len(pieces), count):
+        yield _encode(''.join(pieces[i:i + count]))
+
+
+def readIndex(indexfn):
+    """Read an index file written by writeIndex() (see parseIndex()).
+    """
+    with open(indexfn, 'rb') as fin:
+        return parseIndex(fin.read(), indexfn)
+
+
+def parseIndex(data, indexfn):
+    """Parse the contents, as bytes, of an index file written by writeIndex().
+
+       Returns the base path of the index, the list of its sections, as
+       (file name, section) tuples, each section starting with the file mark,
+       and the list of file names of its trailer.
+    """
+    eol = data.find(b"\n")
+    basepath, offset = parseHeader(data[:eol], indexfn)
+    index = data[eol:offset - 1]
+    trailer = data[offset - 1:]
+    if sys.hexversion >= 0x03000000:
+        index = index.decode('utf-8')
+        trailer = trailer.decode('utf-8')
+    trailer = trailer.split("\n")
+
+    # The index ends with a bare file mark
+    filemark = "\n%s" % Mark(Mark.FILE)
+    if not index.endswith(filemark):
+        raise ValueError("%s: Truncated cscope index" % indexfn)
+    sections = []
+    for section in index.split(filemark)[1:-1]:
+        fname = section[:section.find("\n")]
+        sections.append((fname, filemark + section))
+
+    # The trailer is "1", ".", "0", the number of files and the length of
+    # their names, and the names
+    nfiles = int(trailer[4])
+    return basepath, sections, trailer[6:6 + nfiles]
+
+
+def parseHeader(hdr, indexfn):
+    """Parse the header of an index file, as bytes, returning the base path
+       of the index and the offset of its trailer.
+    """
+    # The header is "cscope 15 <basepath> -c <offset of the trailer>", the
+    # offset being in bytes
+    if sys.hexversion >= 0x03000000:
+        hdr = hdr.decode('utf-8')
+    if not hdr.startswith("cscope 15 ") or hdr[-14:-10] != " -c ":
+        raise ValueError("%s: Not a cscope index" % indexfn)
+    return hdr[10:-14], int(hdr[-10:])
+
+
+def readTrailer(indexfn):
+    """Return the file names of the trailer of the index 'indexfn', reading
+       only its header and trailer.
+    """
+    with open(indexfn, 'rb') as fin:
+        basepath, offset = parseHeader(fin.readline().rstrip(b"\n"), indexfn)
+        fin.seek(offset - 1)
+        trailer = fin.read()
+    if sys.hexversion >= 0x03000000:
+        trailer = trailer.decode('utf-8')
+    trailer = trailer.split("\n")
+    return trailer[6:6 + int(trailer[4])]
+
+
+def iterSections(fin, indexfn, blocksize=1 << 20):
+    """ Generator over the sections of the index file open, in binary mode,
+        as 'fin', yielding a (file name, offset, section) tuple for each,
+        the section being the bytes from its file mark on.
+
+        The file is read a block at a time, so that only one section at a
+        time is held in memory.
+    """
+    filemark = b"\n\t@"
+    buff = fin.read(blocksize)
+    eol = buff.find(b"\n")
+    while eol < 0:
+        more = fin.read(blocksize)
+        if not more:
+            raise ValueError("%s: Not a cscope index" % indexfn)
+        buff += more
+        eol = buff.find(b"\n")
+    basepath, offset = parseHeader(buff[:eol], indexfn)
+    # The index ends with a bare file mark, right before the trailer
+    end = offset - 1 - len(filemark)
+    pos = eol                   # Offset of the start of the buffer
+    buff = buff[eol:]
+    while pos < end:
+        nxt = buff.find(filemark, 1)
+        if nxt < 0:
+            more = fin.read(blocksize)
+            if not more:
+                raise ValueError("%s: Truncated cscope index" % indexfn)
+            buff += more
+            continue
+        if not buff.startswith(filemark):
+            raise ValueError("%s: Not a cscope index" % indexfn)
+        section = buff[:nxt]
+        fname = section[len(filemark):section.find(b"\n", len(filemark))]
+        if sys.hexversion >= 0x03000000:
+            fname = fname.decode('utf-8')
+        yield fname, pos, section
+        buff = buff[nxt:]
+        pos += nxt
+
+
+BLOOM_MAGIC = b'PYCSBLM2'
+BLOOM_HASHES = 7                # Hashes per name, for about 1% false positives
+BLOOM_BITS = 10                 # Bits per name
+
+def bloomBits(name, nbits):
+    """ Return the 'BLOOM_HASHES' bits of a Bloom filter of 'nbits' bits set
+        for the symbol 'name'.
+    """
+    import hashlib, struct
+    # Two hashes of the name are enough to make all the others
+    h1, h2 = struct.unpack('<2Q', hashlib.md5(_encode(name)).digest())
+    return [(h1 + i * h2) % nbits for i in range(BLOOM_HASHES)]
+
+
+def bloomStamp(indexfn):
+    """ Return what tells the index 'indexfn' from another one without
+        reading it all: its size, its modification time in nanoseconds, and
+        the SHA-1 digest of its header and trailer.
+    """
+    import hashlib
+    st = os.stat(indexfn)
+    mtime = getattr(st, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(st.st_mtime * 1000000000)
+    with open(indexfn, 'rb') as fin:
+        hdr = fin.readline()
+        basepath, offset = parseHeader(hdr.rstrip(b"\n"), indexfn)
+        fin.seek(offset - 1)
+        digest = hashlib.sha1(hdr + fin.read()).digest()
+    return st.st_size, mtime, digest
+
+
+def writeBloom(indexfn):
+    """ Write a Bloom filter of the symbol names of each section of the index
+        'indexfn' to 'indexfn'.bloom (see findSymbol()).
+
+        All integers are little-endian unsigned 64 bit values:
+
+            magic       8 bytes, BLOOM_MAGIC
+            header      nsections, index size, index mtime in nanoseconds,
+                        hashes per name
+            digest      20 bytes, of the header and trailer of the index
+            sections    nsections * (offset, size, filter offset, filter size),
+                        each offset being in bytes, in the index for a
+                        section and in the blob for its filter
+            blob        the filters, back to back
+
+        The index size, modification time and digest (see bloomStamp()) tell
+        whether the filters are still those of the index.
+    """
+    import struct
+    table = []
+    blob = []
+    blob_len = 0
+    with open(indexfn, 'rb') as fin:
+        for fname, offset, section in iterSections(fin, indexfn):
+            size = len(section)
+            if sys.hexversion >= 0x03000000:
+                section = section.decode('utf-8')
+            names = set()
+            for lineno, text, symbols in iterIndexLines(section.split("\n")):
+                names.update(name for mark, name in symbols if name)
+            nbytes = max(8, (len(names) * BLOOM_BITS + 7) // 8)
+            bits = bytearray(nbytes)
+            for name in names:
+                for bit in bloomBits(name, nbytes * 8):
+                    bits[bit >> 3] |= 1 << (bit & 7)
+            table.extend((offset, size, blob_len, nbytes))
+            blob.append(bytes(bits))
+            blob_len += nbytes
+
+    size, mtime, digest = bloomStamp(indexfn)
+    with open(indexfn + ".bloom", 'wb') as fout:
+        fout.write(BLOOM_MAGIC)
+        fout.write(struct.pack('<4Q', len(table) // 4, size, mtime, BLOOM_HASHES))
+        fout.write(digest)
+        fout.write(struct.pack('<%dQ' % len(table), *table))
+        fout.write(b''.join(blob))
+
+
+def bloomSections(indexfn, name):
+    """ Return the (offset, size) of the sections of the index 'indexfn'
+        whose Bloom filter (see writeBloom()) may have the symbol 'name', or
+        None if the index has no filters, or they are out of date.
+    """
+    import struct
+    try:
+        with open(indexfn + ".bloom", 'rb') as fin:
+            data = fin.read()
+    except (IOError, OSError):
+        return None
+    if data[:8] != BLOOM_MAGIC:
+        return None
+    try:
+        nsections, size, mtime, nhashes = struct.unpack_from('<4Q', data, 8)
+        digest = data[40:60]
+        if (size, mtime, digest, nhashes) != bloomStamp(indexfn) + (BLOOM_HASHES,):
+            return None
+        table = struct.unpack_from('<%dQ' % (nsections * 4), data, 60)
+    except struct.error:
+        return None
+    blob = bytearray(data[60 + nsections * 32:])
+    if any(table[i] + table[i + 1] > len(blob) for i in range(2, len(table), 4)):
+        return None
+
+    candidates = []
+    bits = {}                   # The bits of the name, by filter size
+    for i in range(0, len(table), 4):
+        offset, size, start, nbytes = table[i:i + 4]
+        if nbytes not in bits:
+            bits[nbytes] = bloomBits(name, nbytes * 8)
+        for bit in bits[nbytes]:
+            if not blob[start + (bit >> 3)] & (1 << (bit & 7)):
+                break
+        else:
+            candidates.append((offset, size))
+    return candidates
+
+
+def findSymbol(indexfn, name):
+    """ Generator over the lines of the index 'indexfn' with the symbol
+        'name', yielding a (file, line number, mark, text) tuple for each
+        time the symbol is found, the mark being empty for unmarked ones.
+
+        When the index has up to date Bloom filters (see writeBloom()), only
+        the sections that may have the symbol are read; otherwise all are.
+    """
+    candidates = bloomSections(indexfn, name)
+    with open(indexfn, 'rb') as fin:
+        if candidates is None:
+            sections = (section for fname, offset, section in iterSections(fin, indexfn))
+        else:
+            sections = (readSection(fin, entry) for entry in candidates)
+        for section in sections:
+            if sys.hexversion >= 0x03000000:
+                section = section.decode('utf-8')
+            rows = section.split("\n")
+            fname = rows[1][2:]
+            for lineno, text, symbols in iterIndexLines(rows):
+                for mark, symbol in symbols:
+                    if symbol == name:
+                        yield fname, lineno, mark, text
+
+
+class Distribution(object):
+    """ An installed distribution: its name and version, the directory it
+        is installed in, and its Python source files, relative to it.
+    """
+    def __init__(self, name, version, root, fnames):
+        self.name = name
+        self.version = version
+        self.root = root
+        self.fnames = fnames
+
+
+def _distKey(name):
+    # Distribution names compare without case and punctuation (PEP 503)
+    import re
+    return re.sub(r"[-_.]+", "_", name).lower()
+
+
+def findDistribution(name, path=None):
+    """ Find the distribution 'name' installed in one of the directories of
+        'path' (sys.path by default) from its .dist-info or .egg-info
+        metadata, or return None.
+    """
+    if path is None:
+        path = sys.path
+    for root in path:
+        root = os.path.abspath(root or os.curdir)
+        if not os.path.isdir(root):
+            continue
+        for entry in sorted(os.listdir(root)):
+            base, ext = os.path.splitext(entry)
+            if ext not in (".dist-info", ".egg-info"):
+                continue
+            # The metadata directory is named <name>-<version>[-pyX.Y]
+            parts = base.split("-")
+            if len(parts) < 2 or _distKey(parts[0]) != _distKey(name):
+                continue
+            infodir = os.path.join(root, entry)
+            if not os.path.isdir(infodir):
+                continue
+            return Distribution(parts[0], parts[1], root, distFiles(root, infodir))
+    return None
+
+
+def layerKey(dist):
+    """ Return the name of the prebuilt index of the distribution 'dist',
+        e.g. foo_bar-1.0-py3.9-1.2.1-S, for the options in effect.
+    """
+    return "%s-%s-py%d.%d-%s%s" % (_distKey(dist.name), dist.version, sys.version_info[0],
+                                   sys.version_info[1], __version__, "-S" if strings_as_symbols else "")
+
+
+def distFiles(root, infodir):
+    """ Return the Python source files of a distribution installed in 'root',
+        relative to it, from its RECORD or installed-files.txt, or else from
+        the packages of its top_level.txt.
+    """
+    fnames = []
+    record = os.path.join(infodir, "RECORD")
+    installed = os.path.join(infodir, "installed-files.txt")
+    toplevel = os.path.join(infodir, "top_level.txt")
+    if os.path.isfile(record):
+        with open(record, "r") as f:
+            for line in f:
+                # path,hash,size; a path with a comma is quoted
+                fname = line.rstrip("\r\n").rsplit(",", 2)[0].strip('"')
+                fnames.append(fname)
+    elif os.path.isfile(installed):
+        infoname = os.path.basename(infodir)
+        with open(installed, "r") as f:
+            for line in f:
+                fname = os.path.normpath(os.path.join(infoname, line.strip()))
+                fnames.append(fname)
+    elif os.path.isfile(toplevel):
+        with open(toplevel, "r") as f:
+            for line in f:
+                name = line.strip()
+                if os.path.isdir(os.path.join(root, name)):
+                    fnames.extend(parseDir(root, name, True))
+                elif os.path.isfile(os.path.join(root, name + ".py")):
+                    fnames.append(name + ".py")
+    # Scripts and the like may be installed outside of 'root'
+    return [fname for fname in fnames
+            if isPython(fname) and not os.path.isabs(fname) and not fname.startswith(os.pardir)]
+
+
+def layerIndex(dist, cachedir, debug=False):
+    """ Return the sections and file names of the prebuilt index of the
+        distribution 'dist', building it first if it is not in 'cachedir'.
+
+        The prebuilt index is keyed by the name and version of the
+        distribution, so that it is built once and shared by all the
+        indexes layered on top of it, and by what else changes its
+        contents: the version of Python, whose grammar parses it, the
+        version of pycscope and the -S option (see layerKey()). Its file
+        names are relative to the directory the distribution is installed
+        in, and are made absolute here.
+    """
+    indexfn = os.path.join(cachedir, "%s.out" % layerKey(dist))
+    if not os.path.isfile(indexfn):
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        indexbuff, fnamesbuff = work(dist.root, dist.fnames, debug)
+        # Written under another name first, as others may be reading it
+        tmpfn = "%s.%d" % (indexfn, os.getpid())
+        saveIndex(dist.root, tmpfn, indexbuff, fnamesbuff)
+        os.rename(tmpfn, indexfn)
+
+    basepath, sections, fnames = readIndex(indexfn)
+    spliced = []
+    for fname, section in sections:
+        spliced.append(formatFileMark(os.path.join(dist.root, fname)))
+        spliced.append(section[len(formatFileMark(fname)):])
+    return spliced, [os.path.join(dist.root, fname) for fname in fnames]
+
+
+class IndexBuffer(object):
+    """ A buffer for the index, like the list returned by work() by default,
+        that keeps at most 'limit' bytes in memory: beyond that, the pieces
+        buffered are spilled to a temporary file.
+
+        The pieces are kept encoded. Iterating over the buffer returns the
+        whole index, in order, as bytes, in pieces of up to 'limit' bytes.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self.parts = []
+        self.size = 0               # Bytes in memory
+        self.length = 0             # Bytes in all
+        self.spill = None
+
+    def append(self, s):
+        s = _encode(s)
+        self.parts.append(s)
+        self.size += len(s)
+        self.length += len(s)
+        if self.size > self.limit:
+            self.flush()
+
+    def extend(self, strings):
+        for s in strings:
+            self.append(s)
+
+    def flush(self):
+        ''' Spill the pieces in memory to the temporary file
+        '''
+        if self.spill is None:
+            import tempfile
+            self.spill = tempfile.TemporaryFile('w+b', prefix='pycscope')
+        self.spill.write(b''.join(self.parts))
+        self.parts = []
+        self.size = 0
+
+    def __iter__(self):
+        if self.spill is not None:
+            self.spill.flush()
+            self.spill.seek(0)
+            chunk = self.spill.read(self.limit)
+            while chunk:
+                yield chunk
+                chunk = self.spill.read(self.limit)
+            self.spill.seek(0, os.SEEK_END)
+        for s in self.parts:
+            yield s
+
+    def close(self):
+        ''' Discard the buffer, and its temporary file
+        '''
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+        self.parts = []
+        self.size = self.length = 0
+
+
+class Progress(object):
+    """ Shows the progress of work() on 'stream', a terminal, on a line
+        updated at most every 'interval' seconds: the files done, and left
+        if the 'total' number of files is known, the files and megabytes
+        of source parsed per second, and the time left.
+    """
+    def __init__(self, stream, total=None, interval=0.2):
+        import time
+        self.stream = stream
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.bytes = 0
+        self.start = self.shown = time.time()
+
+    def started(self, relpath):
+        pass
+
+    def finished(self, relpath, size, index_size, seconds):
+        self.bytes += size
+        self.failed(relpath, None)
+
+    def failed(self, relpath, message):
+        import time
+        self.done += 1
+        now = time.time()
+        if now - self.shown >= self.interval:
+            self.shown = now
+            self.show(now)
+
+    def format(self, now):
+        elapsed = max(now - self.start, 1e-6)
+        rate = self.done / elapsed
+        text = "%d files" % self.done
+        if self.total is not None:
+            text = "%d/%d files, %d left" % (self.done, self.total, self.total - self.done)
+        text += ", %.1f files/s, %.2f MB/s" % (rate, self.bytes / elapsed / (1 << 20))
+        if self.total is not None and rate > 0:
+            left = int((self.total - self.done) / rate)
+            text += ", ETA %d:%02d" % (left // 60, left % 60)
+        return text
+
+    def show(self, now):
+        # Over the previous line, clearing what is left of it
+        self.stream.write("\rpycscope.py: %s\x1b[K" % self.format(now))
+        self.stream.flush()
+
+    def close(self):
+        ''' Show the final counts, and end the line
+        '''
+        import time
+        self.show(time.time())
+        self.stream.write("\n")
+
+
+class EventWriter(object):
+    """ Writes the events of work() to the file 'path', or to standard
+        output for '-', as JSON lines as they happen, e.g.:
+
+            {"event": "start", "file": "a.py", "time": ...}
+            {"bytes": 512, "event": "finish", "file": "a.py", "index_bytes": 230, "seconds": 0.002, "time": ...}
+            {"event": "error", "file": "b.py", "message": "Line 3: invalid syntax", "time": ...}
+
+        and a last "end" event with the number of files and errors, and the
+        seconds taken.
+    """
+    def __init__(self, path):
+        import time
+        if path == "-":
+            self.fout = sys.stdout
+        else:
+            self.fout = open(path, "w")
+        self.files = 0
+        self.errors = 0
+        self.start = time.time()
+
+    def write(self, event, **fields):
+        ''' Write an event, at once
+        '''
+        import json, time
+        fields["event"] = event
+        fields["time"] = time.time()
+        self.fout.write(json.dumps(fields, sort_keys=True) + "\n")
+        self.fout.flush()
+
+    def started(self, relpath):
+        self.write("start", file=relpath)
+
+    def finished(self, relpath, size, index_size, seconds):
+        self.files += 1
+        self.write("finish", file=relpath, bytes=size, index_bytes=index_size, seconds=seconds)
+
+    def failed(self, relpath, message):
+        self.files += 1
+        self.errors += 1
+        self.write("error", file=relpath, message=message)
+
+    def close(self):
+        ''' Write the end event, and close the file
+        '''
+        import time
+        self.write("end", files=self.files, errors=self.errors, seconds=time.time() - self.start)
+        if self.fout is not sys.stdout:
+            self.fout.close()
+
+
+class Stats(object):
+    """ Counts of the work done by work().
+    """
+    def __init__(self):
+        self.files = 0              # Number of files indexed
+        self.bytes = 0              # Size of the files indexed
+        self.parsed = 0             # Number of files actually parsed
+        self.duplicates = 0         # Number of files with the contents of another
+        self.duplicate_bytes = 0    # Size of those files, whose parsing was saved
+        self.errors = 0             # Number of files that could not be indexed
+
+    def format(self):
+        return "%d files (%d bytes): %d parsed, %d duplicates (%d bytes) reused, %d errors" % (
+            self.files, self.bytes, self.parsed, self.duplicates, self.duplicate_bytes, self.errors)
+    __str__ = format
+
+
+def work(basepath, gen, debug, sinks=(), prefetch=0, diskorder=False, stats=None, maxmemory=None, read=None,
+         events=(), visitors=None, records=None):
     """ The actual work of parsing the files.
+
+        Files with the same contents as a file already parsed are not
+        parsed again; the index of the first one is reused.
+
+        Each file successfully parsed is also handed to every sink in
+        'sinks', via sink.add(relpath, ctx), so that additional outputs
+        can be generated from the same pass.
+
+        With 'prefetch' set, that many threads read the files ahead of
+        the parser (see prefetchFiles()). With 'diskorder' set, the files
+        are read in the order they are laid out on disk (see diskOrder()),
+        while the index is still built in the order of 'gen'.
+
+        The work done is counted in 'stats', if given (see Stats).
+
+        With 'maxmemory' set, the index is returned in an IndexBuffer that
+        spills to disk, and at most about that many bytes of index are
+        kept in memory, half of them by the contents cache. With
+        'diskorder' set, the sections are all kept until the end, though.
+
+        With 'read' given, the bytes of the files are read by read(basepath,
+        relpath) rather than by readData(), e.g. from a git revision (see
+        GitBlobs).
+
+        Each of the listeners in 'events' is told as each file is started,
+        via started(relpath), and then either finished, via finished(relpath,
+        size of the file, size of its index, seconds taken), or failed, via
+        failed(relpath, message) (see Progress and EventWriter).
+
+        The callbacks of 'visitors', if given, are run as each file is
+        parsed (see Visitors). Their results are left in the Context
+        handed to the sinks, so a file with the same contents as one
+        already parsed gets them too. A callback raising an error fails
+        the file, as a syntax error does, and the other files go on.
+
+        With 'records' given, the record of each file indexed is added to
+        it by file name (see writeRecords()): the hash of its contents, and
+        its import statements (see resolveIncludes()).
     """
+    import hashlib, time
 
     # Create the buffer to store the output (list of strings)
-    indexbuff = []
-    indexbuff_len = 0
+    if maxmemory:
+        indexbuff = IndexBuffer(maxmemory - maxmemory // 2)
+    else:
+        indexbuff = []
     fnamesbuff = []
+    if stats is None:
+        stats = Stats()
+    # Hash of the contents to the (index lines, imports, Context) of a file,
+    # the imports only kept for 'records', and the Context for 'sinks'
+    parsed = {}
+    parsed_size = 0             # Size of the index held by those
+
+    if diskorder:
+        fnames = list(gen)
+        order = diskOrder(basepath, fnames)
+        gen = readAhead(basepath, [fnames[i] for i in order])
+        sections = [None] * len(fnames)
+
+    if prefetch:
+        files = prefetchFiles(basepath, gen, prefetch, read=read)
+    else:
+        files = ((fname, None) for fname in gen)
+
+    for n, (fname, data) in enumerate(files):
+        for listener in events:
+            listener.started(fname)
+        start = time.time()
+        error = None
+        if data is None:
+            try:
+                data = (read or readData)(basepath, fname)
+            except (IOError, OSError) as e:
+                # Reported by parseFile()
+                error = e
+        section = []
+        names = []
+        key = None
+        contents = None
+        entry = None
+        imports = None
+        if data is not None:
+            # The hash of the bytes as read
+            key = hashlib.sha1(data).hexdigest()
+            try:
+                contents = decodeSource(data)
+            except UnicodeError as e:
+                # Reported by parseFile()
+                error = e
+            data = None
+        if contents is not None:
+            entry = parsed.get(key)
+            stats.files += 1
+            stats.bytes += len(contents)
+        if entry is not None:
+            # Same contents as a file already parsed
+            buff, imports, ctx = entry
+            names.append(fname)
+            section.append(formatFileMark(fname))
+            section.extend(buff)
+            stats.duplicates += 1
+            stats.duplicate_bytes += len(contents)
+            if sinks:
+                ctx.source = contents
+                for sink in sinks:
+                    sink.add(fname, ctx)
+                ctx.source = None
+        else:
+            ctx = Context(visitors, keep=bool(sinks))
+            imports = ctx.imports
+            try:
+                parseFile(basepath, fname, section, 0, names, dump=debug, ctx=ctx, contents=contents, read=read)
+            except (SyntaxError, AssertionError, VisitorError) as e:
+                diagnose("%s: Line %s: %s" % (e.filename, e.lineno, e))
+                stats.errors += 1
+                error = "Line %s: %s" % (e.lineno, e)
+            else:
+                if names:
+                    stats.parsed += 1
+                    buff = ctx.buff
+                    size = 0
+                    if maxmemory:
+                        # Within a budget, the index lines are cached as one
+                        # encoded string, and all that is cached is counted
+                        buff = [_encode(''.join(buff))]
+                        size = len(buff[0])
+                        if sinks or records is not None:
+                            size += cacheSize(ctx)
+                    if not maxmemory or parsed_size + size <= maxmemory // 2:
+                        parsed[key] = (buff, imports if records is not None else None,
+                                       ctx if sinks else None)
+                        parsed_size += size
+                    ctx.source = contents
+                    for sink in sinks:
+                        sink.add(fname, ctx)
+                    ctx.source = None
+                else:
+                    stats.errors += 1
+                    error = error or "Can't read the file"
+        if records is not None and names:
+            records[fname] = {"sha1": key, "imports": imports}
+        for listener in events:
+            if error is not None:
+                listener.failed(fname, str(error))
+            else:
+                listener.finished(fname, len(contents), sum(len(_encode(s)) for s in section), time.time() - start)
+        if diskorder:
+            sections[order[n]] = (section, names)
+        else:
+            indexbuff.extend(section)
+            fnamesbuff.extend(names)
 
-    for fname in gen:
-        try:
-            indexbuff_len = parseFile(basepath, fname, indexbuff, indexbuff_len, fnamesbuff, dump=debug)
-        except (SyntaxError, AssertionError) as e:
-            print("pycscope.py: %s: Line %s: %s" % (e.filename, e.lineno, e))
-            pass
+    if diskorder:
+        for section, names in sections:
+            indexbuff.extend(section)
+            fnamesbuff.extend(names)
+
+    closeArchives()
 
     return indexbuff, fnamesbuff
 
 
+def cacheSize(ctx):
+    """ Return about how many bytes the lines, symbols, definitions and
+        imports of the Context 'ctx' take up, as counted against the budget
+        of the contents cache of work().
+    """
+    size = 0
+    for rows in (ctx.lines, ctx.symbols, ctx.definitions, ctx.imports):
+        size += sys.getsizeof(rows)
+        for row in rows:
+            size += sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+    return size
+
+
+def diskOrder(basepath, fnames):
+    """ Returns the indices of the given files, sorted by where the files
+        are on disk (device and inode number), so that reading the files
+        in that order avoids seeking back and forth.
+    """
+    keys = []
+    for i, fname in enumerate(fnames):
+        # Members of an archive are where the archive is
+        archive, member = splitArchivePath(basepath, fname)
+        try:
+            st = os.stat(os.path.join(basepath, archive or fname))
+            key = (st.st_dev, st.st_ino)
+        except OSError:
+            # Reported when the file is read
+            key = (0, 0)
+        keys.append((key, i))
+    keys.sort()
+    return [i for key, i in keys]
+
+
+def readAhead(basepath, fnames, window=32):
+    """ A generator returning the given files, advising the kernel that
+        the file 'window' files ahead will be needed, so that it reads it
+        ahead of time (on systems providing posix_fadvise()).
+    """
+    advise = getattr(os, 'posix_fadvise', None)
+    for i, fname in enumerate(fnames):
+        if advise is not None:
+            if i == 0:
+                ahead = fnames[:window + 1]
+            else:
+                ahead = fnames[i + window:i + window + 1]
+            for afname in ahead:
+                try:
+                    fd = os.open(os.path.join(basepath, afname), os.O_RDONLY)
+                except OSError:
+                    continue
+                try:
+                    advise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                except OSError:
+                    pass
+                finally:
+                    os.close(fd)
+        yield fname
+
+
 def isPython(name):
     # Is this a python file?
     return name[-3:] == ".py"
 
 
-def genFiles(basepath, args, recurse):
+def genFiles(basepath, args, recurse, sort=False):
     """ A generator for returning all the files that need to be parsed.
         Caller is required to provide synchronization.
+
+        With 'sort' set, directories are searched in order of the names
+        of their entries, so that the files are always returned in the
+        same order.
     """
     for name in args:
         if os.path.isdir(os.path.join(basepath, name)):
-            for fname in parseDir(basepath, name, recurse):
+            for fname in parseDir(basepath, name, recurse, sort):
                 yield fname
+        elif isArchive(name) and os.path.isfile(os.path.join(basepath, name)):
+            # Python source members of an archive are named after it
+            try:
+                members = getArchive(basepath, name).members()
+            except (IOError, OSError) as e:
+                diagnose(e)
+                continue
+            for member in members:
+                yield "%s/%s" % (name, member)
         else:
             # Don't return the file name if it's not python source
             if isPython(name):
                 yield name
 
 
-def parseDir(basepath, relpath, recurse):
+def genRoots(basepath, roots, args, recurse, sort=False):
+    """ A generator for returning all the files that need to be parsed in
+        each of the directories 'roots' (see genFiles()), named relative to
+        'basepath', the directory holding them all (see commonRoot()).
+    """
+    for root in roots:
+        root = os.path.abspath(root)
+        relroot = os.path.relpath(root, basepath)
+        for fname in genFiles(root, args, recurse, sort):
+            yield os.path.normpath(os.path.join(relroot, fname))
+
+
+def commonRoot(paths):
+    """ Return the deepest directory holding all the directories 'paths'.
+    """
+    parts = os.path.commonprefix([os.path.abspath(path).split(os.sep) for path in paths])
+    return os.sep.join(parts) or os.sep
+
+
+def parseDir(basepath, relpath, recurse, sort=False):
     """ A generator that parses all files in the directory and
         recurses into subdirectories if requested.
         Caller is required to provide synchronization.
     """
     dirpath = os.path.join(basepath, relpath)
-    for name in os.listdir(dirpath):
+    names = os.listdir(dirpath)
+    if sort:
+        names.sort()
+    for name in names:
         fullpath = os.path.join(dirpath, name)
         if os.path.isdir(fullpath) and recurse:
-            for fname in parseDir(basepath, os.path.join(relpath, name), recurse):
+            for fname in parseDir(basepath, os.path.join(relpath, name), recurse, sort):
                 yield fname
         else:
             if isPython(name):
                 yield os.path.join(relpath, name)
 
 
-def parseFile(basepath, relpath, indexbuff, indexbuff_len, fnamesbuff, dump=False):
+def readFile(basepath, relpath):
+    """Returns the contents of a source file (see decodeSource()), which may
+       be a member of an archive.
+    """
+    return decodeSource(readData(basepath, relpath))
+
+
+def readData(basepath, relpath):
+    """Returns the bytes of a source file, which may be a member of an
+       archive.
+    """
+    archive, member = splitArchivePath(basepath, relpath)
+    if archive is not None:
+        return getArchive(basepath, archive).read(member)
+    with open(os.path.join(basepath, relpath), 'rb') as f:
+        return f.read()
+
+
+ARCHIVE_SUFFIXES = ('.whl', '.egg', '.zip', '.tar.gz', '.tgz', '.tar.bz2', '.tar')
+
+def isArchive(name):
+    # Is this an archive (zip, wheel, egg or tarball) to read files from?
+    return name.endswith(ARCHIVE_SUFFIXES)
+
+
+def splitArchivePath(basepath, relpath):
+    """ Splits the path of an archive member, archive.whl/pkg/mod.py, into
+        the path of the archive and the name of the member, or returns
+        (None, None) for the path of an ordinary file.
+    """
+    for suffix in ARCHIVE_SUFFIXES:
+        idx = relpath.find(suffix + '/')
+        if idx > 0:
+            idx += len(suffix)
+            if os.path.isfile(os.path.join(basepath, relpath[:idx])):
+                return relpath[:idx], relpath[idx + 1:]
+    return None, None
+
+
+class Archive(object):
+    """ Reads the Python source members of a zip archive (wheels and eggs
+        included) or of a tarball, without extracting them.
+
+        Tarballs are read as a stream, front to back, since compressed
+        ones can't be read at random. Members are expected to be read in
+        the order they are listed; those read ahead of their turn are kept
+        until asked for.
+
+        A damaged archive raises IOError, like a file that can't be read.
+    """
+    def __init__(self, path):
+        import zipfile, tarfile
+        self.path = path
+        self.lock = allocate_lock()
+        self.zip = None
+        self.tar = None             # The tarball being streamed
+        self.pending = {}           # Tarball members read ahead of their turn
+        self.errors = (zipfile.BadZipfile, tarfile.TarError)
+        try:
+            if zipfile.is_zipfile(path):
+                self.zip = zipfile.ZipFile(path)
+        except self.errors as e:
+            raise IOError("%s: %s" % (path, e))
+
+    def members(self):
+        ''' Return the names of the Python source members, in order
+        '''
+        import tarfile
+        if self.zip is not None:
+            return [name for name in self.zip.namelist() if isPython(name)]
+        try:
+            tar = tarfile.open(self.path)
+            try:
+                return [info.name for info in tar.getmembers() if info.isfile() and isPython(info.name)]
+            finally:
+                tar.close()
+        except self.errors as e:
+            raise IOError("%s: %s" % (self.path, e))
+
+    def read(self, member):
+        ''' Return the contents of the given member
+        '''
+        with self.lock:
+            try:
+                return self.readMember(member)
+            except self.errors as e:
+                raise IOError("%s: %s" % (self.path, e))
+
+    def readMember(self, member):
+        ''' Return the contents of the given member, the lock being held
+        '''
+        import tarfile
+        if self.zip is not None:
+            try:
+                return self.zip.read(member)
+            except KeyError:
+                raise IOError("%s: No such file in archive: '%s'" % (self.path, member))
+        if member in self.pending:
+            return self.pending.pop(member)
+        for attempt in range(2):
+            if self.tar is None:
+                self.tar = tarfile.open(self.path, 'r|*')
+            info = self.tar.next()
+            while info is not None:
+                if info.isfile() and isPython(info.name):
+                    data = self.tar.extractfile(info).read()
+                    if info.name == member:
+                        return data
+                    self.pending[info.name] = data
+                info = self.tar.next()
+            # The member was already read once, start again
+            self.close()
+        raise IOError("%s: No such file in archive: '%s'" % (self.path, member))
+
+    def close(self):
+        ''' Close the archive (a tarball is reopened when read again)
+        '''
+        if self.zip is not None:
+            self.zip.close()
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+
+
+archives = {}                   # Open archives, by path
+archives_lock = allocate_lock()
+
+def getArchive(basepath, relpath):
+    """ Return the (shared) Archive object for the given archive path.
+    """
+    fullpath = os.path.join(basepath, relpath)
+    with archives_lock:
+        archive = archives.get(fullpath)
+        if archive is None:
+            archive = archives[fullpath] = Archive(fullpath)
+        return archive
+
+
+def closeArchives():
+    """ Close all the archives opened.
+    """
+    with archives_lock:
+        for archive in archives.values():
+            archive.close()
+        archives.clear()
+
+
+def decodeSource(data):
+    """Decodes the given source file bytes using the encoding given by its
+       BOM or coding cookie (PEP 263), as tokenize.detect_encoding() finds
+       it, with DOS and Mac line endings turned into newlines. A
+       UnicodeError is raised when the source can't be decoded.
+    """
+    if b'\r' in data:
+        # One pass over the bytes for both kinds of line endings
+        import re
+        data = re.sub(b'\r\n?', b'\n', data)
+    if sys.hexversion < 0x03000000:
+        # The Python 2 parser takes the bytes, handling any coding itself
+        return data
+
+    import io, tokenize
+    try:
+        encoding = tokenize.detect_encoding(io.BytesIO(data).readline)[0]
+    except SyntaxError as e:
+        # Bad coding cookie or BOM
+        raise UnicodeError(e.args[0])
+    return data.decode(encoding)
+
+
+def prefetchFiles(basepath, gen, readers, depth=64, read=None):
+    """ A generator returning a (relpath, bytes) tuple for each file from
+        'gen', in order, while a pool of 'readers' threads reads the files
+        ahead of the caller. At most 'depth' files are read ahead, so that
+        memory stays bounded. The bytes are None when the file could not
+        be read, leaving it to the caller to report.
+
+        The files are read by readData(), or by 'read' if given.
+    """
+    import threading
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue
+
+    order = queue.Queue(depth)  # Slots in file order, bounding the read ahead
+    todo = queue.Queue()        # Slots waiting for a reader
+    failed = []                 # Any exception raised generating the files
+
+    def produce():
+        try:
+            for fname in gen:
+                slot = [fname, None, threading.Event()]
+                order.put(slot)
+                todo.put(slot)
+        except Exception as e:
+            failed.append(e)
+        finally:
+            order.put(None)
+            for i in range(readers):
+                todo.put(None)
+
+    def consume():
+        while True:
+            slot = todo.get()
+            if slot is None:
+                return
+            try:
+                slot[1] = (read or readData)(basepath, slot[0])
+            except (IOError, OSError):
+                pass
+            slot[2].set()
+
+    threads = [threading.Thread(target=produce)]
+    threads.extend(threading.Thread(target=consume) for i in range(readers))
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    while True:
+        slot = order.get()
+        if slot is None:
+            break
+        slot[2].wait()
+        yield slot[0], slot[1]
+    if failed:
+        raise failed[0]
+
+
+def formatFileMark(relpath):
+    """Returns the index line(s) marking the start of the given file.
+    """
+    return "\n%s%s\n\n" % (Mark(Mark.FILE), relpath)
+
+
+def parseFile(basepath, relpath, indexbuff, indexbuff_len, fnamesbuff, dump=False, ctx=None, contents=None, read=None):
     """Parses a source file and puts the resulting index into the buffer.
        Caller is required to provide synchronization.
+
+       The contents of the file are read, by readFile() or from the bytes
+       read by 'read' if given, unless already given.
     """
     # Open the file and get the contents
     fullpath = os.path.join(basepath, relpath)
-    try:
-        f = open(fullpath, 'rU')
-    except IOError as e:
-        # Can't open a file, emit message and ignore
-        print("pycscope.py: %s" % e)
-        return indexbuff_len
-    filecontents = f.read()
-    f.close()
+    if contents is None:
+        try:
+            contents = decodeSource((read or readData)(basepath, relpath))
+        except IOError as e:
+            # Can't open a file, emit message and ignore
+            diagnose(e)
+            return indexbuff_len
+        except UnicodeError as e:
+            # Can't decode a file, emit message and ignore
+            diagnose("%s: %s" % (fullpath, e))
+            return indexbuff_len
 
     # Add the file mark to the index
     fnamesbuff.append(relpath)
-    indexbuff.append("\n%s%s\n\n" % (Mark(Mark.FILE), relpath))
+    indexbuff.append(formatFileMark(relpath))
     indexbuff_len += 1
 
     # Add path info to any syntax errors in the source files
-    if filecontents:
+    if contents:
         try:
-            indexbuff_len = parseSource(filecontents, indexbuff, indexbuff_len, dump)
-        except (SyntaxError, AssertionError) as e:
+            indexbuff_len = parseSource(contents, indexbuff, indexbuff_len, dump, ctx)
+        except (SyntaxError, AssertionError, VisitorError) as e:
             e.filename = fullpath
             raise e
 
     return indexbuff_len
 
-nodeNames = token.tok_name
-nodeNames.update(symbol.sym_name)
+# Names of the node types, by number (set by loadGrammar())
+nodeNames = None
 
 def replaceNodeType(treeList):
     """ Replaces the 0th element in the list with the name
@@ -268,6 +2555,7 @@ def replaceNodeType(treeList):
 def dumpCst(cst, stream=None):
     """ For debugging, dump in a pretty printed form the concrete syntax tree.
     """
+    loadGrammar()
     if type(cst) == tuple:
         cst_l = list(cst)
     else:
@@ -352,6 +2640,12 @@ class Symbol(object):
         """
         return self.__mark == mark
 
+    def parts(self):
+        """ Return the mark character ('' if none) and the name of this
+            symbol.
+        """
+        return self.__mark.char(), self.__name
+
 
 class NonSymbol(object):
     """ A representation of a what cscope considers a 'non-symbol' text.
@@ -474,6 +2768,30 @@ class Line(object):
         return "\n".join(buff) + "\n\n"
     __str__ = format
 
+    def record(self):
+        """ Return the text of this source line (that has a symbol) and the
+            (mark, name) of each of its symbols, as iterIndexLines() reads
+            them back from the formatted line, without formatting it.
+        """
+        text = []
+        symbols = []
+        last = len(self.__contents) - 1
+        for i in range(len(self.__contents)):
+            item = self.__contents[i]
+            if isinstance(item, Symbol):
+                mark, name = item.parts()
+                symbols.append((mark, name))
+                text.append(name)
+            else:
+                # Spaced as format() does
+                s = item.format()
+                if i > 0 and s != ' ':
+                    s = ' ' + s
+                if i < last and (i == 0 or s != ' '):
+                    s += ' '
+                text.append(s)
+        return ''.join(text), symbols
+
     def __repr__(self):
         return "<Line:%s>" % self.format().replace("\n", "\\n")
 
@@ -485,12 +2803,9 @@ class Line(object):
         return NotImplemented
 
 
-if sys.hexversion < 0x03000000:
-    valid_tokens_for_marks = (token.NAME, token.DOT)
-    valid_tokens_for_import = (token.DOT,)
-else:
-    valid_tokens_for_marks = (token.NAME, token.DOT, token.ELLIPSIS)
-    valid_tokens_for_import = (token.DOT, token.ELLIPSIS)
+# Tokens of dotted names, and of the dots of relative imports (set by
+# loadGrammar())
+valid_tokens_for_marks = valid_tokens_for_import = None
 
 
 class Context(object):
@@ -510,7 +2825,7 @@ class Context(object):
         Symbol. The dictionary of Marks encapsulates that state.
     '''
     # Buffer of lines in the Cscope database (individual strings in a list)
-    def __init__(self):
+    def __init__(self, visitors=None, keep=False):
         self.buff = []              # The accumlated list of lines with symbols
         self.line = Line(1)         # The current line being processed
         self.marks = {}             # Association of CST tuples to a Mark
@@ -520,6 +2835,36 @@ class Context(object):
         self.import_name = False    # Handling an import ... statement (not from ... import ...)
         self.tests = {}             # List of CST test objects tracked for assignment
         self.power_do_assignment = False
+        self.scope = []             # Stack of (name, indent level, mark) of enclosing classes and functions
+        self.definitions = []       # List of (qualified name, mark, line number) definitions
+        self.visitors = visitors    # Callbacks of the analyses run in the same pass (see Visitors)
+        self.results = {}           # Results of those analyses, by the keys they choose
+        self.keep = keep            # Keep the lines and symbols of the buffer, for the sinks
+        self.lines = []             # List of (line number, text) of the lines in the buffer, if kept
+        self.symbols = []           # List of (mark, name, line number, function) of their symbols, if kept
+        self.func = None            # Function the symbols are in, as its marks delimit it
+        self.imports = []           # List of (line number, level, module, names) of the import statements
+        self.source = None          # Contents of the file, while handed to the sinks
+
+    def define(self, tup, mark):
+        ''' Record the definition of the given NAME tuple, qualified by the
+            names of the enclosing classes and functions
+        '''
+        qualname = '.'.join([s[0] for s in self.scope] + [tup[1]])
+        self.definitions.append((qualname, mark, tup[2]))
+
+    def enter(self, tup, mark, suite):
+        ''' Record the definition of the given class or function NAME
+            tuple, and enter its scope until the end of the given suite
+        '''
+        self.define(tup, mark)
+        if suite[1][0] == token.NEWLINE:
+            # The scope ends with the dedent back to the current level
+            lvl = self.indent_lvl
+        else:
+            # The body is on the same line, so the scope ends with it
+            lvl = None
+        self.scope.append((tup[1], lvl, mark))
 
     def setMark(self, tup, mark):
         ''' Add a mark to the dictionary for the given tuple
@@ -547,11 +2892,35 @@ class Context(object):
         line = str(self.line)
         if line:
             self.buff.append(line)
+            if self.keep or self.visitors is not None:
+                self.record(self.line)
         if lineno:
             self.line = Line(lineno)
         else:
             self.line = None
 
+    def record(self, line):
+        ''' Record the text and the symbols of a line added to the buffer,
+            for the sinks if kept, and run the callbacks of the visitors for
+            them
+        '''
+        text, symbols = line.record()
+        if self.keep:
+            self.lines.append((line.lineno, text))
+        for mark, name in symbols:
+            if mark == Mark.FUNC_DEF:
+                self.func = name
+            if self.keep:
+                self.symbols.append((mark, name, line.lineno, self.func))
+            if mark == Mark.FUNC_END:
+                self.func = None
+            if self.visitors is not None:
+                for callback in self.visitors.marks.get(mark, ()):
+                    try:
+                        callback(self, name, line.lineno)
+                    except Exception as e:
+                        raise VisitorError(callback, e, line.lineno)
+
 
 def isNamedFuncCall(cst, cst_len):
     """ Figure out if this CST sub-tree represents a named function call;
@@ -595,235 +2964,347 @@ def markTestlist(ctx, cst):
         ctx.tests[id(cst[i])] = cst[i]
 
 
-if sys.hexversion < 0x02070000:
-    tse = symbol.testlist
-    test_or_star_expr = (symbol.test,)
-    testlist_comp = (symbol.testlist_gexp, symbol.listmaker)
-elif sys.hexversion < 0x03000000:
-    tse = symbol.testlist
-    test_or_star_expr = (symbol.test,)
+# Symbols that differ between versions of the grammar (set by loadGrammar())
+tse = test_or_star_expr = testlist_comp = None
+
+def processGlobalStmt(ctx, cst):
+    """ Mark the names declared global
+    """
+    # Handle global declarations
+    for i in range(2, len(cst)):
+        if not i % 2:
+            # Even indices are the names
+            assert cst[i][0] == token.NAME
+            ctx.setMark(cst[i], Mark.GLOBAL)
+            # Global names always belong to the module scope
+            ctx.definitions.append((cst[i][1], Mark.GLOBAL, cst[i][2]))
+
+def processFuncdef(ctx, cst):
+    """ Mark (outer most) function definitions
+    """
+    idx = 1
+    if cst[idx][0] == symbol.decorators:
+        # Skip the optional decorators under pre-2.7
+        # FIXME: verify this is the case.
+        idx += 1
+    assert (cst[idx][0] == token.NAME) and (cst[idx][1] == 'def')
+    idx += 1
+    if ctx.func_def_lvl == -1:
+        # Handle function definitions. NOTE: we only mark the
+        # outer most function name as a function definition
+        # since the cscope utility can't handle nested
+        # functions. So all nested function definitions will
+        # not be marked as such.
+        ctx.func_def_lvl = ctx.indent_lvl
+        ctx.setMark(cst[idx], Mark.FUNC_DEF)
+    # Nested functions still get a qualified name of their own
+    ctx.enter(cst[idx], Mark.FUNC_DEF, cst[-1])
+
+def processDecorated(ctx, cst):
+    """ Mark the decorators of functions as function calls
+    """
+    # Handle function decorators only.
+    if (cst[1][0] != symbol.decorators) or (cst[2][0] != symbol.funcdef):
+        return
+    dcsts = cst[1]
+    for i in range(1, len(dcsts)):
+        # Handle each decorator
+        dcst = dcsts[i]
+
+        assert dcst[0] == symbol.decorator
+        assert dcst[1][0] == token.AT
+        assert dcst[2][0] == symbol.dotted_name
+
+        dotted = dcst[2]
+        dotted_len = len(dotted)
+        assert dotted_len >= 2
+        if dotted_len > 2:
+            # When decorators use dotted names, but we don't want to
+            # consider the entire sequence as the function being called
+            # since the functions are not defined that way. Instead, we
+            # only mark the last symbol in the sequence as being a
+            # function call.
+            ctx.setMark(dotted[-1], Mark.FUNC_CALL)
+        elif dotted_len == 2:
+            # Check for some builtin ones we should ignore
+            assert dotted[-1][0] == token.NAME
+            if dotted[-1][1] not in ('property', 'classmethod'):
+                ctx.setMark(dotted[-1], Mark.FUNC_CALL)
+
+def processImportFrom(ctx, cst):
+    """ Mark the module of from ... import ... statements as an include
+    """
+    # The next tuple is the "from" string, so grab the following dotted
+    # name tuple, and mark each NAME and DOT terminal in that tuple list
+    # as an include. As they are added to the line they'll be merged into
+    # one big symbol marked as an include.
+    dnidx = 2
+    while cst[dnidx][0] in valid_tokens_for_import:
+        dnidx += 1
+    # The dots of a relative import are DOT, or ELLIPSIS for three
+    level = sum(len(tok[1]) for tok in cst[2:dnidx])
+    module = ''
+    if cst[dnidx][0] == symbol.dotted_name:
+        for i in range(1, len(cst[dnidx])):
+            ctx.setMark(cst[dnidx][i], Mark.INCLUDE)
+        module = ''.join(tok[1] for tok in cst[dnidx][1:])
+    # The names imported are the first NAME of each import_as_name, be they
+    # in parentheses or continued over several lines
+    names = []
+    for node in cst[dnidx:]:
+        if node[0] == symbol.import_as_names:
+            names = [child[1][1] for child in node[1:] if child[0] == symbol.import_as_name]
+    ctx.imports.append((cst[1][2], level, module, names))
+
+def processImportName(ctx, cst):
+    """ Note the start of import ... statements
+    """
+    # We are dealing with import ... statements, where for dotted name
+    # non-terminals it indicates an include module reference
+    ctx.import_name = True
+    for node in cst[2][1:]:
+        if node[0] == symbol.dotted_as_name:
+            module = ''.join(tok[1] for tok in node[1][1:])
+            ctx.imports.append((cst[1][2], 0, module, []))
+
+def processDottedAsNames(ctx, cst):
+    """ Count the modules of import ... statements
+    """
+    if not ctx.import_name:
+        return
+    # Figure out how many imports are being performed for:
+    #
+    #     import a as b, b as c, c as d, ...
+    #
+    # We use a count so we don't have to walk the tree twice, allowing us
+    # to NOT consider the "as foo" as a symbol, only the "dotted" names.
+    ctx.import_cnt = len(cst)/2
+
+def processDottedName(ctx, cst):
+    """ Mark the modules of import ... statements as includes
+    """
+    # Handle dotted names for imports
+    if ctx.import_name:
+        assert ctx.import_cnt >= 1
+        # For imports, we want to collect them all together to form one
+        # symbol. To do that, we set each following tuple, which will be
+        # NAME, or NAME DOT NAME, etc. to all have INCLUDE marks. As the
+        # tree walk continues, these symbols sharing the same mark will be
+        # appended to make one continuous name.name.name symbol.,
+        for i in range(1, len(cst)):
+            ctx.setMark(cst[i], Mark.INCLUDE)
+        ctx.import_cnt -= 1
+        if ctx.import_cnt == 0:
+            ctx.import_name = False
+
+def processExprStmt(ctx, cst):
+    """ Note the targets of assignment statements
+    """
+    # Look for assignment statements
+    l = len(cst)
+    if (l >= 4):
+        assert (cst[1][0] == tse)
+        if (cst[2][0] == symbol.augassign) and (cst[3][0] in (symbol.testlist, symbol.yield_expr)):
+            # testlist or testlist_star_expr, augassign, testlist
+            assert cst[1][1][0] == symbol.test, "%s is not symbol.test" % nodeNames[cst[1][1][0]]
+            ctx.tests[id(cst[1][1])] = cst[1][1]
+        elif (cst[2][0] == token.EQUAL):
+            # testlist or testlist_star_expr, EQUAL, ...
+            markTestlist(ctx, cst[1])
+            for i in range(3, l - 1):
+                if cst[i][0] == token.EQUAL:
+                    continue
+                if cst[i][0] != tse:
+                    break
+                # We have another testlist, EQUAL, ...
+                markTestlist(ctx, cst[i])
+
+def processTest(ctx, cst):
+    """ Note when the target of an assignment is being walked
+    """
+    if id(cst) in ctx.tests:
+        # We happen to have a test CST that is part of an assignment
+        # expression of some sort. It is assumed that deep inside this CST
+        # subtree is a power CST subtree that is (one of) the target(s) of
+        # the assignment to be marked. Since other CST tuples have to be
+        # processed in between, we set a flag for the power symbol
+        # handling to actually perform the marking.
+        assert cst == ctx.tests[id(cst)], "%r(%d) != %r(%d)" % (cst, id(cst), ctx.tests[id(cst)], id(cst))
+        del ctx.tests[id(cst)]
+        assert not ctx.power_do_assignment
+        ctx.power_do_assignment = True
+
+def processClassdef(ctx, cst):
+    """ Mark class definitions
+    """
+    # Handle class declarations.
+    assert (cst[1][0] == token.NAME) and (cst[1][1] == 'class')
+    ctx.setMark(cst[2], Mark.CLASS)
+    ctx.enter(cst[2], Mark.CLASS, cst[-1])
+
+def processPower(ctx, cst):
+    """ Mark assignment targets and function calls
+    """
+    l_cst = len(cst)
+    if ctx.power_do_assignment:
+        ctx.power_do_assignment = False
+        # power
+        #   atom
+        #     NAME
+        # power
+        #   atom
+        #     (|[
+        #       test
+        #       ...
+        #     )|]
+        if (l_cst == 2) and (cst[1][0] == symbol.atom):
+            if len(cst[1]) == 2 and cst[1][1][0] == token.NAME:
+                ctx.setMark(cst[1][1], Mark.ASSIGN)
+                if not ctx.scope or ctx.scope[-1][2] == Mark.CLASS:
+                    # Module and class attributes, but not locals
+                    ctx.define(cst[1][1], Mark.ASSIGN)
+            elif len(cst[1]) == 4 \
+                    and cst[1][1][0] in (token.LPAR, token.LSQB) \
+                    and cst[1][2][0] in testlist_comp \
+                    and cst[1][3][0] in (token.RPAR, token.RSQB):
+                for i in range(1, len(cst[1][2])):
+                    if cst[1][2][i][0] == token.COMMA:
+                        continue
+                    if cst[1][2][i][0] != symbol.test:
+                        break
+                    ctx.tests[id(cst[1][2][i])] = cst[1][2][i]
+
+        # power
+        #   atom
+        #     NAME
+        #   trailer
+        #     LSQB
+        #     subscriptlist
+        #     RSQB
+        elif l_cst == 3 \
+                and cst[1][0] == symbol.atom \
+                and len(cst[1]) == 2 \
+                and cst[1][ 1][0] == token.NAME \
+                and len(cst[2]) >= 4 \
+                and cst[2][ 0] == symbol.trailer \
+                and cst[2][ 1][0] == token.LSQB \
+                and cst[2][-1][0] == token.RSQB:
+            ctx.setMark(cst[1][1], Mark.ASSIGN)
+
+        # power
+        #   atom
+        #   ...
+        #   trailer
+        #     DOT
+        #     NAME
+        elif l_cst >= 3 \
+                and len(cst[-1]) == 3 \
+                and cst[-1][0] == symbol.trailer \
+                and cst[-1][1][0] == token.DOT \
+                and cst[-1][2][0] == token.NAME:
+            ctx.setMark(cst[-1][2], Mark.ASSIGN)
+
+        # power
+        #   atom
+        #   ...
+        #   trailer
+        #     DOT
+        #     NAME
+        #   trailer
+        #     LSQB
+        #     subscriptlist
+        #     RSQB
+        elif l_cst >= 4 \
+                and len(cst[-2]) == 3 \
+                and cst[-2][0] == symbol.trailer \
+                and cst[-2][1][0] == token.DOT \
+                and cst[-2][2][0] == token.NAME \
+                and len(cst[-1]) >= 4 \
+                and cst[-1][ 0] == symbol.trailer \
+                and cst[-1][ 1][0] == token.LSQB \
+                and cst[-1][-1][0] == token.RSQB:
+            ctx.setMark(cst[-2][2], Mark.ASSIGN)
+
+    if isNamedFuncCall(cst, l_cst):
+        # Simple named functional call like: name() or name(a,b=1,c)
+        ctx.setMark(cst[1][1], Mark.FUNC_CALL)
+    for i in range(1, l_cst - 1):
+        if isTrailerFuncCall(cst, i, l_cst):
+            # Handle named function calls like: name.name() or
+            # name.name(a,b=1,c)
+            ctx.setMark(cst[i][2], Mark.FUNC_CALL)
+
+# Handlers of the non-terminal symbols of interest, by node type; all other
+# non-terminals need no processing at all (set by loadGrammar())
+nonTerminalHandlers = None
+
+# Strings that are valid identifiers, see strings_as_symbols
+stringSymbol = None
+
+def loadGrammar():
+    """ Import the parser modules and build the tables of their grammar, on
+        first use.
+    """
+    global parser, symbol, token, kwlist, nodeNames
+    global valid_tokens_for_marks, valid_tokens_for_import, tse, test_or_star_expr, testlist_comp
+    global nonTerminalHandlers, stringSymbol
+
+    if nonTerminalHandlers is not None:
+        return
+    import keyword, re
+    import parser, symbol, token
+
+    kwlist = frozenset(keyword.kwlist + ["True", "False", "None"])
+
+    nodeNames = dict(token.tok_name)
+    nodeNames.update(symbol.sym_name)
+
+    if sys.hexversion < 0x03000000:
+        valid_tokens_for_marks = (token.NAME, token.DOT)
+        valid_tokens_for_import = (token.DOT,)
+    else:
+        valid_tokens_for_marks = (token.NAME, token.DOT, token.ELLIPSIS)
+        valid_tokens_for_import = (token.DOT, token.ELLIPSIS)
+
     if sys.hexversion < 0x02070000:
+        tse = symbol.testlist
+        test_or_star_expr = (symbol.test,)
         testlist_comp = (symbol.testlist_gexp, symbol.listmaker)
-    else:
+    elif sys.hexversion < 0x03000000:
+        tse = symbol.testlist
+        test_or_star_expr = (symbol.test,)
         testlist_comp = (symbol.testlist_comp, symbol.listmaker)
-else:
-    tse = symbol.testlist_star_expr
-    test_or_star_expr = (symbol.test, symbol.star_expr)
-    testlist_comp = (symbol.testlist_comp,)
+    else:
+        tse = symbol.testlist_star_expr
+        test_or_star_expr = (symbol.test, symbol.star_expr)
+        testlist_comp = (symbol.testlist_comp,)
+
+    stringSymbol = re.compile("^('|\"|'''|\"\"\")([A-Za-z_][A-Za-z_0-9]*)('|\"|'''|\"\"\")$")
+
+    handlers = {
+        symbol.global_stmt: processGlobalStmt,
+        symbol.funcdef: processFuncdef,
+        symbol.decorated: processDecorated,
+        symbol.import_from: processImportFrom,
+        symbol.import_name: processImportName,
+        symbol.dotted_as_names: processDottedAsNames,
+        symbol.dotted_name: processDottedName,
+        symbol.expr_stmt: processExprStmt,
+        symbol.classdef: processClassdef,
+        symbol.power: processPower,
+        }
+    for t in test_or_star_expr:
+        handlers[t] = processTest
+    # Last, as it tells the grammar is loaded
+    nonTerminalHandlers = handlers
 
 def processNonTerminal(ctx, cst):
     """ Process a given CST tuple representing a non-terminal symbol
     """
-    # We have a non-terminal "symbol"
-    if cst[0] == symbol.global_stmt:
-        # Handle global declarations
-        for i in range(2, len(cst)):
-            if not i % 2:
-                # Even indices are the names
-                assert cst[i][0] == token.NAME
-                ctx.setMark(cst[i], Mark.GLOBAL)
-    elif cst[0] == symbol.funcdef:
-        if ctx.func_def_lvl == -1:
-            # Handle function definitions. NOTE: we only mark the
-            # outer most function name as a function definition
-            # since the cscope utility can't handle nested
-            # functions. So all nested function definitions will
-            # not be marked as such.
-            ctx.func_def_lvl = ctx.indent_lvl
-            idx = 1
-            if cst[idx][0] == symbol.decorators:
-                # Skip the optional decorators under pre-2.7
-                # FIXME: verify this is the case.
-                idx += 1
-            assert (cst[idx][0] == token.NAME) and (cst[idx][1] == 'def')
-            idx += 1
-            ctx.setMark(cst[idx], Mark.FUNC_DEF)
-    elif cst[0] == symbol.decorated \
-            and (cst[1][0] == symbol.decorators) \
-            and (cst[2][0] == symbol.funcdef):
-        # Handle function decorators only.
-        dcsts = cst[1]
-        for i in range(1, len(dcsts)):
-            # Handle each decorator
-            dcst = dcsts[i]
-
-            assert dcst[0] == symbol.decorator
-            assert dcst[1][0] == token.AT
-            assert dcst[2][0] == symbol.dotted_name
-
-            dotted = dcst[2]
-            dotted_len = len(dotted)
-            assert dotted_len >= 2
-            if dotted_len > 2:
-                # When decorators use dotted names, but we don't want to
-                # consider the entire sequence as the function being called
-                # since the functions are not defined that way. Instead, we
-                # only mark the last symbol in the sequence as being a
-                # function call.
-                ctx.setMark(dotted[-1], Mark.FUNC_CALL)
-            elif dotted_len == 2:
-                # Check for some builtin ones we should ignore
-                assert dotted[-1][0] == token.NAME
-                if dotted[-1][1] not in ('property', 'classmethod'):
-                    ctx.setMark(dotted[-1], Mark.FUNC_CALL)
-    elif cst[0] == symbol.import_from:
-        # The next tuple is the "from" string, so grab the following dotted
-        # name tuple, and mark each NAME and DOT terminal in that tuple list
-        # as an include. As they are added to the line they'll be merged into
-        # one big symbol marked as an include.
-        dnidx = 2
-        while cst[dnidx][0] in valid_tokens_for_import:
-            dnidx += 1
-        if cst[dnidx][0] == symbol.dotted_name:
-            for i in range(1, len(cst[dnidx])):
-                ctx.setMark(cst[dnidx][i], Mark.INCLUDE)
-    elif cst[0] == symbol.import_name:
-        # We are dealing with import ... statements, where for dotted name
-        # non-terminals it indicates an include module reference
-        ctx.import_name = True
-    elif cst[0] == symbol.dotted_as_names and ctx.import_name:
-        # Figure out how many imports are being performed for:
-        #
-        #     import a as b, b as c, c as d, ...
-        #
-        # We use a count so we don't have to walk the tree twice, allowing us
-        # to NOT consider the "as foo" as a symbol, only the "dotted" names.
-        ctx.import_cnt = len(cst)/2
-    elif cst[0] == symbol.dotted_name:
-        # Handle dotted names for imports
-        if ctx.import_name:
-            assert ctx.import_cnt >= 1
-            # For imports, we want to collect them all together to form one
-            # symbol. To do that, we set each following tuple, which will be
-            # NAME, or NAME DOT NAME, etc. to all have INCLUDE marks. As the
-            # tree walk continues, these symbols sharing the same mark will be
-            # appended to make one continuous name.name.name symbol.,
-            for i in range(1, len(cst)):
-                ctx.setMark(cst[i], Mark.INCLUDE)
-            ctx.import_cnt -= 1
-            if ctx.import_cnt == 0:
-                ctx.import_name = False
-    elif cst[0] == symbol.expr_stmt:
-        # Look for assignment statements
-        l = len(cst)
-        if (l >= 4):
-            assert (cst[1][0] == tse)
-            if (cst[2][0] == symbol.augassign) and (cst[3][0] in (symbol.testlist, symbol.yield_expr)):
-                # testlist or testlist_star_expr, augassign, testlist
-                assert cst[1][1][0] == symbol.test, "%s is not symbol.test" % nodeNames[cst[1][1][0]]
-                ctx.tests[id(cst[1][1])] = cst[1][1]
-            elif (cst[2][0] == token.EQUAL):
-                # testlist or testlist_star_expr, EQUAL, ...
-                markTestlist(ctx, cst[1])
-                for i in range(3, l - 1):
-                    if cst[i][0] == token.EQUAL:
-                        continue
-                    if cst[i][0] != tse:
-                        break
-                    # We have another testlist, EQUAL, ...
-                    markTestlist(ctx, cst[i])
-    elif cst[0] in test_or_star_expr:
-        if id(cst) in ctx.tests:
-            # We happen to have a test CST that is part of an assignment
-            # expression of some sort. It is assumed that deep inside this CST
-            # subtree is a power CST subtree that is (one of) the target(s) of
-            # the assignment to be marked. Since other CST tuples have to be
-            # processed in between, we set a flag for the power symbol
-            # handling to actually perform the marking.
-            assert cst == ctx.tests[id(cst)], "%r(%d) != %r(%d)" % (cst, id(cst), ctx.tests[id(cst)], id(cst))
-            del ctx.tests[id(cst)]
-            assert not ctx.power_do_assignment
-            ctx.power_do_assignment = True
-    elif cst[0] == symbol.classdef:
-        # Handle class declarations.
-        assert (cst[1][0] == token.NAME) and (cst[1][1] == 'class')
-        ctx.setMark(cst[2], Mark.CLASS)
-    elif cst[0] == symbol.power:
-        l_cst = len(cst)
-        if ctx.power_do_assignment:
-            ctx.power_do_assignment = False
-            # power
-            #   atom
-            #     NAME
-            # power
-            #   atom
-            #     (|[
-            #       test
-            #       ...
-            #     )|]
-            if (l_cst == 2) and (cst[1][0] == symbol.atom):
-                if len(cst[1]) == 2 and cst[1][1][0] == token.NAME:
-                    ctx.setMark(cst[1][1], Mark.ASSIGN)
-                elif len(cst[1]) == 4 \
-                        and cst[1][1][0] in (token.LPAR, token.LSQB) \
-                        and cst[1][2][0] in testlist_comp \
-                        and cst[1][3][0] in (token.RPAR, token.RSQB):
-                    for i in range(1, len(cst[1][2])):
-                        if cst[1][2][i][0] == token.COMMA:
-                            continue
-                        if cst[1][2][i][0] != symbol.test:
-                            break
-                        ctx.tests[id(cst[1][2][i])] = cst[1][2][i]
-
-            # power
-            #   atom
-            #     NAME
-            #   trailer
-            #     LSQB
-            #     subscriptlist
-            #     RSQB
-            elif l_cst == 3 \
-                    and cst[1][0] == symbol.atom \
-                    and len(cst[1]) == 2 \
-                    and cst[1][ 1][0] == token.NAME \
-                    and len(cst[2]) >= 4 \
-                    and cst[2][ 0] == symbol.trailer \
-                    and cst[2][ 1][0] == token.LSQB \
-                    and cst[2][-1][0] == token.RSQB:
-                ctx.setMark(cst[1][1], Mark.ASSIGN)
+    handler = nonTerminalHandlers.get(cst[0])
+    if handler is not None:
+        handler(ctx, cst)
 
-            # power
-            #   atom
-            #   ...
-            #   trailer
-            #     DOT
-            #     NAME
-            elif l_cst >= 3 \
-                    and len(cst[-1]) == 3 \
-                    and cst[-1][0] == symbol.trailer \
-                    and cst[-1][1][0] == token.DOT \
-                    and cst[-1][2][0] == token.NAME:
-                ctx.setMark(cst[-1][2], Mark.ASSIGN)
-
-            # power
-            #   atom
-            #   ...
-            #   trailer
-            #     DOT
-            #     NAME
-            #   trailer
-            #     LSQB
-            #     subscriptlist
-            #     RSQB
-            elif l_cst >= 4 \
-                    and len(cst[-2]) == 3 \
-                    and cst[-2][0] == symbol.trailer \
-                    and cst[-2][1][0] == token.DOT \
-                    and cst[-2][2][0] == token.NAME \
-                    and len(cst[-1]) >= 4 \
-                    and cst[-1][ 0] == symbol.trailer \
-                    and cst[-1][ 1][0] == token.LSQB \
-                    and cst[-1][-1][0] == token.RSQB:
-                ctx.setMark(cst[-2][2], Mark.ASSIGN)
-
-        if isNamedFuncCall(cst, l_cst):
-            # Simple named functional call like: name() or name(a,b=1,c)
-            ctx.setMark(cst[1][1], Mark.FUNC_CALL)
-        for i in range(1, l_cst - 1):
-            if isTrailerFuncCall(cst, i, l_cst):
-                # Handle named function calls like: name.name() or
-                # name.name(a,b=1,c)
-                ctx.setMark(cst[i][2], Mark.FUNC_CALL)
 
 def processTerminal(ctx, cst):
     """ Process a given CST tuple representing a terminal symbol
@@ -839,6 +3320,8 @@ def processTerminal(ctx, cst):
         # changes so that we can properly mark the end of a
         # function.
         ctx.indent_lvl -= 1
+        if ctx.scope and ctx.scope[-1][1] == ctx.indent_lvl:
+            ctx.scope.pop()
         if ctx.indent_lvl == ctx.func_def_lvl:
             ctx.func_def_lvl = -1
             ctx.line += Symbol('', Mark.FUNC_END)
@@ -855,8 +3338,10 @@ def processTerminal(ctx, cst):
     if cst[0] == token.NEWLINE:
         # Handle new line tokens: we ignore them as a change in
         # the line number for a token will commit a line (or EOF,
-        # see below).
-        pass
+        # see below). They do end the scope of a class or function
+        # defined all on one line.
+        if ctx.scope and ctx.scope[-1][1] is None:
+            ctx.scope.pop()
     elif cst[0] == token.INDENT:
         # Indentation is not recorded, but still processed
         ctx.indent_lvl += 1
@@ -864,7 +3349,7 @@ def processTerminal(ctx, cst):
         # Handle strings: make sure newline's within strings are
         # escaped.
         if strings_as_symbols:
-            m = re.search("^('|\"|'''|\"\"\")([A-Za-z_][A-Za-z_0-9]*)('|\"|'''|\"\"\")$", cst[1])
+            m = stringSymbol.search(cst[1])
             if m is not None:
                 # We have a string that is a valid Python identifier, emit the
                 # enclosing quotes as non-symbols and the string as a symbol.
@@ -908,51 +3393,118 @@ def processTerminal(ctx, cst):
 
 def walkCst(ctx, cst):
     """ Scan the CST (tuple) for tokens, appending index lines to the buffer.
+
+        The callbacks of the visitors of the context, if any, for the type
+        of each node are run before the node is processed (see Visitors).
     """
-    indent = 0
     lineno = 1
-    stack = [(cst, indent)]
+    stack = [cst]
+    pop = stack.pop
+    push = stack.extend
+    handlers = nonTerminalHandlers
+    visits = ctx.visitors.nodeCallbacks() if ctx.visitors is not None else None
     try:
         while stack:
-            cst, indent = stack.pop()
-
-            #print("%5d%s%s" % (lineno, " " * indent, nodeNames[cst[0]]))
-
-            if token.ISNONTERMINAL(cst[0]):
-                processNonTerminal(ctx, cst)
+            cst = pop()
+
+            if visits:
+                for callback in visits.get(cst[0], ()):
+                    try:
+                        callback(ctx, cst)
+                    except Exception as e:
+                        raise VisitorError(callback, e)
+            if cst[0] >= token.NT_OFFSET:
+                handler = handlers.get(cst[0])
+                if handler is not None:
+                    handler(ctx, cst)
+                # All the children of a non-terminal are tuples: push them
+                # in reverse so that they are processed in order, mirroring
+                # a recursive solution
+                push(cst[:0:-1])
             else:
                 lineno = processTerminal(ctx, cst)
-
-            indented = False
-            for i in range(len(cst)-1, 0, -1):
-                if type(cst[i]) == tuple:
-                    # Push it onto the processing stack
-                    # Mirrors a recursive solution
-                    if not indented:
-                        indent += 2
-                        indented = True
-                    stack.append((cst[i], indent))
     except Exception as e:
         e.lineno = lineno
         raise e
 
-def parseSource(sourcecode, indexbuff, indexbuff_len, dump=False):
+class VisitorError(Exception):
+    """ An error raised by a callback of the visitors, failing the file
+        being parsed rather than the whole run (see work()).
+    """
+    def __init__(self, callback, error, lineno=None):
+        name = getattr(callback, '__name__', repr(callback))
+        Exception.__init__(self, "%s: %s: %s" % (name, type(error).__name__, error))
+        self.error = error
+        self.lineno = lineno
+        self.filename = None
+
+class Visitors(object):
+    """ The callbacks of analyses run in the same pass as the indexing, so
+        that the files are parsed and walked only once for them all.
+
+        Callbacks are registered by node type, e.g. "decorator", "NAME",
+        via onNode(), and are called as callback(ctx, node) for each node of
+        that type, before it is processed; terminal nodes are (type,
+        string, line number) tuples. Callbacks registered by mark, e.g.
+        Mark.FUNC_CALL, via onMark(), are called as callback(ctx, name,
+        lineno) for each symbol so marked, once its line is done.
+
+        The Context 'ctx' given holds the state of the walk, e.g. the
+        enclosing classes and functions (ctx.scope). Analyses keep their
+        results in ctx.results, under keys of their own, for their sinks to
+        write out as each file is handed to them (see work()).
+    """
+    def __init__(self):
+        self.nodes = {}             # Node type name to its callbacks
+        self.marks = {}             # Mark to its callbacks
+        self.compiled = None        # Node type number to its callbacks
+
+    def onNode(self, name, callback):
+        ''' Call callback(ctx, node) for each node of the type 'name'
+        '''
+        self.nodes.setdefault(name, []).append(callback)
+        self.compiled = None
+
+    def onMark(self, mark, callback):
+        ''' Call callback(ctx, name, lineno) for each symbol marked 'mark'
+        '''
+        self.marks.setdefault(mark, []).append(callback)
+
+    def nodeCallbacks(self):
+        ''' Return the callbacks by node type number (see loadGrammar())
+        '''
+        if self.compiled is None:
+            numbers = dict((name, num) for num, name in nodeNames.items())
+            for name in self.nodes:
+                if name not in numbers:
+                    raise ValueError("Unknown node type: %s" % name)
+            self.compiled = dict((numbers[name], callbacks) for name, callbacks in self.nodes.items())
+        return self.compiled
+
+
+def parseSource(sourcecode, indexbuff, indexbuff_len, dump=False, ctx=None):
     """Parses python source code and puts the resulting index information into the buffer.
+
+       The source is expected to have newline line endings, as
+       decodeSource() leaves them. A Context object may be given so that
+       the caller can look at the results of the pass afterwards;
+       otherwise a new one is used.
     """
     if len(sourcecode) == 0:
         return indexbuff_len
 
     # Parse the source to an Concrete Syntax Tree (cst)
-    sourcecode = sourcecode.replace('\r\n', '\n')
     if sourcecode[-1] != '\n':
         # We need to make sure files are terminated by a newline.
         sourcecode += '\n'
+    loadGrammar()
     cst = parser.suite(sourcecode)
 
     if dump:
         dumpCst(cst)
 
-    ctx = Context()
+    if ctx is None:
+        ctx = Context()
 
     walkCst(ctx, cst.totuple(True))
     indexbuff.extend(ctx.buff)
@@ -960,5 +3512,379 @@ def parseSource(sourcecode, indexbuff, indexbuff_len, dump=False):
     return indexbuff_len
 
 
+def iterIndexLines(rows):
+    """ Generator over the rows of a cscope index (one string per line of
+        the database, without the newline), yielding a tuple of
+        (lineno, text, symbols) for each source line found, where symbols
+        is the ordered list of (mark, name) pairs on that line; unmarked
+        symbols have an empty mark.
+    """
+    lineno = None
+    for row in rows:
+        if not row:
+            # An empty row ends the source line
+            if lineno is not None:
+                yield lineno, ''.join(text), symbols
+                lineno = None
+        elif lineno is None:
+            if row[0] == '\t':
+                # File marks are not source lines
+                continue
+            num, _, rest = row.partition(' ')
+            lineno = int(num)
+            text = [rest]
+            symbols = []
+        elif row[0] == '\t':
+            symbols.append((row[1], row[2:]))
+            text.append(row[2:])
+        elif row[0] == ' ':
+            text.append(row)
+        else:
+            symbols.append(('', row))
+            text.append(row)
+    if lineno is not None:
+        yield lineno, ''.join(text), symbols
+
+
+def _encode(s):
+    """ Return the given string as UTF-8 encoded bytes.
+    """
+    if isinstance(s, bytes):
+        return s
+    return s.encode('utf-8')
+
+
+def _packU32(values):
+    """ Pack a sequence of unsigned integers as little-endian 32 bit values.
+    """
+    import array
+    a = array.array('I', values)
+    assert a.itemsize == 4, "Expected 4 byte unsigned integers"
+    if sys.byteorder == 'big':
+        a.byteswap()
+    if hasattr(a, 'tobytes'):
+        return a.tobytes()
+    return a.tostring()
+
+
+GRAPH_MAGIC = b'PYCSGRPH'
+
+class GraphWriter(object):
+    """ Collects the call graph and the import graph of the files parsed,
+        and writes them out as a compact binary edge list on close().
+
+        All integers are little-endian unsigned 32 bit values, so that
+        each table can be mapped directly as an array:
+
+            magic       8 bytes, GRAPH_MAGIC
+            header      nstrings, ncalls, nincludes, blob length
+            calls       ncalls * (file, caller, callee) string ids
+            includes    nincludes * (file, module) string ids
+            offsets     (nstrings + 1) offsets into the string blob
+            blob        the UTF-8 encoded strings, back to back
+
+        The caller of a call made outside of a function is the file itself.
+        The module of an include is as imported, with the leading dots of a
+        relative import, e.g. '.sub' for from .sub import c; each name of
+        from . import b, which names no module, is one: '.b'.
+    """
+    def __init__(self, path):
+        import array
+        self.path = path
+        self.strings = {}           # String to its id in the string table
+        self.calls = array.array('I')
+        self.includes = array.array('I')
+
+    def intern(self, s):
+        ''' Return the id of the given string in the string table
+        '''
+        idx = self.strings.get(s)
+        if idx is None:
+            idx = self.strings[s] = len(self.strings)
+        return idx
+
+    def add(self, relpath, ctx):
+        ''' Record the edges found in the context of the given file
+        '''
+        fid = self.intern(relpath)
+        for mark, name, lineno, func in ctx.symbols:
+            if mark == Mark.FUNC_CALL:
+                caller = fid if func is None else self.intern(func)
+                self.calls.extend((fid, caller, self.intern(name)))
+        for lineno, level, module, names in ctx.imports:
+            for name in ([module] if module else names):
+                self.includes.extend((fid, self.intern('.' * level + name)))
+
+    def close(self):
+        ''' Write out the graph
+        '''
+        import struct
+        strings = [None] * len(self.strings)
+        for s, idx in self.strings.items():
+            strings[idx] = _encode(s)
+        offsets = [0]
+        for s in strings:
+            offsets.append(offsets[-1] + len(s))
+
+        with open(self.path, 'wb') as fout:
+            fout.write(GRAPH_MAGIC)
+            fout.write(struct.pack('<4I', len(strings), len(self.calls) // 3,
+                                   len(self.includes) // 2, offsets[-1]))
+            fout.write(_packU32(self.calls))
+            fout.write(_packU32(self.includes))
+            fout.write(_packU32(offsets))
+            fout.write(b''.join(strings))
+
+
+def readGraph(path):
+    """ Read a graph written by a GraphWriter, returning a tuple of the
+        list of (file, caller, callee) calls and the list of (file, module)
+        includes.
+    """
+    import struct
+    with open(path, 'rb') as fin:
+        data = fin.read()
+    assert data[:8] == GRAPH_MAGIC, "%s is not a pycscope graph" % path
+    nstrings, ncalls, nincludes, bloblen = struct.unpack_from('<4I', data, 8)
+    pos = 24
+    calls = struct.unpack_from('<%dI' % (ncalls * 3), data, pos)
+    pos += ncalls * 12
+    includes = struct.unpack_from('<%dI' % (nincludes * 2), data, pos)
+    pos += nincludes * 8
+    offsets = struct.unpack_from('<%dI' % (nstrings + 1), data, pos)
+    pos += (nstrings + 1) * 4
+    strings = [data[pos + offsets[i]:pos + offsets[i + 1]].decode('utf-8') for i in range(nstrings)]
+
+    return [tuple(strings[i] for i in calls[j:j + 3]) for j in range(0, len(calls), 3)], \
+           [tuple(strings[i] for i in includes[j:j + 2]) for j in range(0, len(includes), 2)]
+
+
+def _decode(s):
+    """ Return the given string as text, decoding UTF-8 bytes if needed.
+    """
+    if isinstance(s, bytes):
+        return s.decode('utf-8', 'replace')
+    return s
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS lines (
+    file_id INTEGER NOT NULL,
+    lineno INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (file_id, lineno)
+);
+CREATE TABLE IF NOT EXISTS symbols (
+    file_id INTEGER NOT NULL,
+    lineno INTEGER NOT NULL,
+    mark TEXT NOT NULL,
+    name TEXT NOT NULL,
+    func TEXT
+);
+CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name, mark);
+CREATE INDEX IF NOT EXISTS symbols_func ON symbols (func, mark);
+CREATE INDEX IF NOT EXISTS symbols_file ON symbols (file_id);
+"""
+
+class SqliteWriter(object):
+    """ Stores the files, lines and symbols of the files parsed in an
+        indexed SQLite database, as an alternative to the cscope database.
+
+        Files already in the database are replaced. Unless 'prune' is
+        false, the files not handed to the writer, e.g. those gone or that
+        no longer parse, are removed on close(), so that the database has
+        the files of the index; otherwise they are left as they are, so a
+        database can be updated one file at a time. The inserts are
+        batched, committing every 'batch' files.
+
+        Each symbol records the outer most function it appears in (func),
+        so that callers of a function are an indexed lookup:
+
+            SELECT func FROM symbols WHERE name = ? AND mark = '`'
+    """
+    def __init__(self, path, batch=500, prune=True):
+        import sqlite3
+
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SQLITE_SCHEMA)
+        self.batch = batch
+        self.pending = 0
+        self.prune = prune
+        self.paths = set()          # Paths of the files added
+
+    def add(self, relpath, ctx):
+        ''' Insert (or replace) the lines and symbols of the given file
+        '''
+        cur = self.db.cursor()
+        relpath = _decode(relpath)
+        self.paths.add(relpath)
+        cur.execute("SELECT id FROM files WHERE path = ?", (relpath,))
+        row = cur.fetchone()
+        if row:
+            fid = row[0]
+            cur.execute("DELETE FROM lines WHERE file_id = ?", (fid,))
+            cur.execute("DELETE FROM symbols WHERE file_id = ?", (fid,))
+        else:
+            cur.execute("INSERT INTO files (path) VALUES (?)", (relpath,))
+            fid = cur.lastrowid
+
+        lines = [(fid, lineno, _decode(text)) for lineno, text in ctx.lines]
+        symbols = [(fid, lineno, mark, _decode(name), func if func is None else _decode(func))
+                   for mark, name, lineno, func in ctx.symbols if mark != Mark.FUNC_END]
+        cur.executemany("INSERT INTO lines VALUES (?, ?, ?)", lines)
+        cur.executemany("INSERT INTO symbols VALUES (?, ?, ?, ?, ?)", symbols)
+
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        ''' Remove the files not added, if pruning, commit any pending
+            inserts and close the database
+        '''
+        if self.prune:
+            cur = self.db.cursor()
+            stale = [(fid,) for fid, path in cur.execute("SELECT id, path FROM files").fetchall()
+                     if path not in self.paths]
+            cur.executemany("DELETE FROM lines WHERE file_id = ?", stale)
+            cur.executemany("DELETE FROM symbols WHERE file_id = ?", stale)
+            cur.executemany("DELETE FROM files WHERE id = ?", stale)
+        self.db.commit()
+        self.db.close()
+
+
+class TagsWriter(object):
+    """ Collects the class, function and global definitions of the files
+        parsed, and writes them out as a sorted vi style 'tags' file, or as
+        an emacs style 'TAGS' file when emacs is set, on close().
+    """
+    # Marks of the definitions to write, with their ctags kind
+    kinds = {Mark.CLASS: 'c', Mark.FUNC_DEF: 'f', Mark.GLOBAL: 'v'}
+
+    def __init__(self, path, emacs=False):
+        self.path = path
+        self.emacs = emacs
+        self.files = []             # List of (relpath, tags) tuples
+
+    def add(self, relpath, ctx):
+        ''' Record the definitions found in the context of the given file
+        '''
+        tags = []
+        lines = None
+        for mark, name, lineno, func in ctx.symbols:
+            if mark in self.kinds:
+                text = None
+                if self.emacs:
+                    # The source line, for the search pattern
+                    if lines is None:
+                        lines = (ctx.source or '').split('\n')
+                    text = lines[lineno - 1] if lineno <= len(lines) else name
+                tags.append((name, lineno, self.kinds[mark], text))
+        self.files.append((relpath, tags))
+
+    def close(self):
+        ''' Write out the tags file
+        '''
+        if self.emacs:
+            self.writeEtags()
+        else:
+            self.writeCtags()
+
+    def writeCtags(self):
+        entries = []
+        for relpath, tags in self.files:
+            for name, lineno, kind, text in tags:
+                entries.append('%s\t%s\t%d;"\t%s\n' % (name, relpath, lineno, kind))
+        entries.sort()
+
+        with open(self.path, 'wb') as fout:
+            fout.write(b'!_TAG_FILE_FORMAT\t2\t/extended format/\n')
+            fout.write(b'!_TAG_FILE_SORTED\t1\t/0=unsorted, 1=sorted, 2=foldcase/\n')
+            fout.write(b'!_TAG_PROGRAM_NAME\tpycscope\t//\n')
+            fout.write(_encode('!_TAG_PROGRAM_VERSION\t%s\t//\n' % __version__))
+            for entry in entries:
+                fout.write(_encode(entry))
+
+    def writeEtags(self):
+        with open(self.path, 'wb') as fout:
+            for relpath, tags in self.files:
+                entries = []
+                for name, lineno, kind, text in tags:
+                    # The tag text must be a prefix of the source line, so
+                    # only keep the line up to the name
+                    end = text.find(name)
+                    if end >= 0:
+                        text = text[:end + len(name)]
+                    entries.append(_encode('%s\x7f%s\x01%d,\n' % (text, name, lineno)))
+                body = b''.join(entries)
+                fout.write(b'\x0c\n')
+                fout.write(_encode('%s,%d\n' % (relpath, len(body))))
+                fout.write(body)
+
+
+def moduleName(relpath):
+    """ Return the dotted module name of the given source file path, e.g.
+        ./pkg/__init__.py is pkg, and pkg/mod.py is pkg.mod.
+    """
+    path = os.path.normpath(relpath)
+    for suffix in ARCHIVE_SUFFIXES:
+        # Members of an archive are named relative to the archive
+        idx = path.find(suffix + os.sep)
+        if idx > 0:
+            path = path[idx + len(suffix) + 1:]
+            break
+    if path.endswith('.py'):
+        path = path[:-3]
+    parts = [p for p in path.split(os.sep) if p not in ('', '.')]
+    if len(parts) > 1 and parts[-1] == '__init__':
+        parts.pop()
+    return '.'.join(parts)
+
+
+class ScopeWriter(object):
+    """ Collects the fully qualified names (module.Class.method) of the
+        classes, functions, globals and module or class attributes defined
+        in the files parsed, and writes them out on close() as a sorted
+        index, one definition per line:
+
+            qualified name <TAB> mark <TAB> file <TAB> line number
+
+        Being sorted, the index can be searched for a name, or all the
+        names under a prefix, with a binary search (e.g. look(1)).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+
+    def add(self, relpath, ctx):
+        ''' Record the definitions found in the context of the given file
+        '''
+        module = moduleName(relpath)
+        for qualname, mark, lineno in ctx.definitions:
+            self.entries.append(_encode('%s.%s\t%s\t%s\t%d\n' % (module, qualname, mark, relpath, lineno)))
+
+    def close(self):
+        ''' Write out the sorted index
+        '''
+        self.entries.sort()
+        with open(self.path, 'wb') as fout:
+            fout.write(b''.join(self.entries))
+
+
+# The commands of main(), other than indexing
+commands = {
+    "export": exportMain,
+    "import": importMain,
+    "diff": diffMain,
+    "impact": impactMain,
+    "find": findMain,
+}
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""Unit tests for indexing archives without extracting them.
+"""
+
+import unittest
+import os
+import io
+import tarfile
+import zipfile
+import tempfile
+import shutil
+import pycscope
+
+
+class TestArchives(unittest.TestCase):
+
+    def setUp(self,):
+        self.tmpd = tempfile.mkdtemp()
+        self.members = [('pkg/__init__.py', b"import os\n"),
+                        ('pkg/mod.py', b"def f():\n    pass\n"),
+                        ('pkg/data.txt', b"not python\n")]
+
+    def tearDown(self,):
+        shutil.rmtree(self.tmpd)
+
+    def makeZip(self, name):
+        with zipfile.ZipFile(os.path.join(self.tmpd, name), 'w') as z:
+            for member, data in self.members:
+                z.writestr(member, data)
+
+    def makeTar(self, name):
+        tar = tarfile.open(os.path.join(self.tmpd, name), 'w:gz')
+        try:
+            for member, data in self.members:
+                info = tarfile.TarInfo(member)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        finally:
+            tar.close()
+
+    def testgenfiles(self,):
+        self.makeZip('x.whl')
+        self.makeTar('y.tar.gz')
+        ret = list(pycscope.genFiles(self.tmpd, ['x.whl', 'y.tar.gz'], False))
+        self.assertEqual(ret, ['x.whl/pkg/__init__.py', 'x.whl/pkg/mod.py',
+                               'y.tar.gz/pkg/__init__.py', 'y.tar.gz/pkg/mod.py'])
+
+    def testwork(self,):
+        self.makeZip('x.whl')
+        fnames = list(pycscope.genFiles(self.tmpd, ['x.whl'], False))
+        indexbuff, fnamesbuff = pycscope.work(self.tmpd, fnames, False)
+        self.assertEqual(fnamesbuff, fnames)
+        index = ''.join(indexbuff)
+        self.assertTrue('\t@x.whl/pkg/mod.py\n' in index)
+        self.assertTrue('\t$f\n' in index)
+
+    def testtarorder(self,):
+        self.makeTar('y.tar.gz')
+        archive = pycscope.Archive(os.path.join(self.tmpd, 'y.tar.gz'))
+        try:
+            self.assertEqual(archive.read('pkg/mod.py'), b"def f():\n    pass\n")
+            self.assertEqual(archive.read('pkg/__init__.py'), b"import os\n")
+            self.assertEqual(archive.read('pkg/mod.py'), b"def f():\n    pass\n")
+            self.assertRaises(IOError, archive.read, 'pkg/nope.py')
+        finally:
+            archive.close()
+
+    def testmodulename(self,):
+        self.assertEqual(pycscope.moduleName('x.whl/pkg/mod.py'), 'pkg.mod')
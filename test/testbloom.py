@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""Unit tests for the Bloom filters of the symbols of each file.
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import pycscope
+
+
+class TestBloom(unittest.TestCase):
+
+    def setUp(self,):
+        self.orig_wd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+        self.write('a.py', "def f():\n    pass\n")
+        self.write('b.py', "s = '\xc3\xa9t\xc3\xa9'\nf()\n")
+        self.write('c.py', "c = 1\n")
+        self.indexfn = os.path.join(self.tmpd, 'cscope.out')
+
+    def tearDown(self,):
+        os.chdir(self.orig_wd)
+        shutil.rmtree(self.tmpd)
+
+    def write(self, fname, contents):
+        with open(os.path.join(self.tmpd, fname), "w") as f:
+            f.write(contents)
+
+    def testbloom(self,):
+        self.assertEqual(pycscope.main(['arg0', '--bloom', 'a.py', 'b.py', 'c.py']), 0)
+        self.assertTrue(os.path.isfile(self.indexfn + '.bloom'))
+
+        # Only the sections that may have the name are read
+        with open(self.indexfn, 'rb') as f:
+            sections = [(offset, len(section)) for fname, offset, section in pycscope.iterSections(f, self.indexfn)]
+        self.assertEqual(pycscope.bloomSections(self.indexfn, 'f'), sections[:2])
+        self.assertEqual(pycscope.bloomSections(self.indexfn, 'c'), sections[2:])
+        self.assertEqual(pycscope.bloomSections(self.indexfn, 'nosuchname'), [])
+
+        ret = list(pycscope.findSymbol(self.indexfn, 'f'))
+        self.assertEqual(ret[0], ('a.py', 1, '$', 'def f ( ) :'))
+        self.assertEqual([(fname, lineno, text) for fname, lineno, mark, text in ret[1:]], [('b.py', 2, 'f ( )')])
+        self.assertEqual(list(pycscope.findSymbol(self.indexfn, 'nosuchname')), [])
+
+        # Without the filters, all the sections are read
+        self.assertEqual(pycscope.main(['arg0', 'a.py', 'b.py', 'c.py']), 0)
+        self.assertFalse(os.path.exists(self.indexfn + '.bloom'))
+        self.assertEqual(pycscope.bloomSections(self.indexfn, 'f'), None)
+        self.assertEqual(list(pycscope.findSymbol(self.indexfn, 'f')), ret)
+
+    def testbloomstale(self,):
+        self.assertEqual(pycscope.main(['arg0', '--bloom', 'a.py', 'c.py']), 0)
+        os.rename(self.indexfn + '.bloom', 'bloom')
+        self.assertEqual(pycscope.main(['arg0', 'a.py', 'b.py', 'c.py']), 0)
+        os.rename('bloom', self.indexfn + '.bloom')
+        # The filters of another index are not used
+        self.assertEqual(pycscope.bloomSections(self.indexfn, 'f'), None)
+        self.assertEqual(len(list(pycscope.findSymbol(self.indexfn, 'f'))), 2)
+
+        # Nor those of an index of the same size, rebuilt right after
+        self.assertEqual(pycscope.main(['arg0', '--bloom', 'a.py', 'c.py']), 0)
+        os.rename(self.indexfn + '.bloom', 'bloom')
+        self.write('a.py', "def g():\n    pass\n")
+        self.assertEqual(pycscope.main(['arg0', 'a.py', 'c.py']), 0)
+        os.rename('bloom', self.indexfn + '.bloom')
+        self.assertEqual(pycscope.bloomSections(self.indexfn, 'g'), None)
+        self.assertEqual(len(list(pycscope.findSymbol(self.indexfn, 'g'))), 1)
+
+    def testbloomcorrupt(self,):
+        self.assertEqual(pycscope.main(['arg0', '--bloom', 'a.py', 'c.py']), 0)
+        with open(self.indexfn + '.bloom', 'rb') as f:
+            data = f.read()
+        # Truncated filters are not used
+        for size in (20, 70, len(data) - 1):
+            with open(self.indexfn + '.bloom', 'wb') as f:
+                f.write(data[:size])
+            self.assertEqual(pycscope.bloomSections(self.indexfn, 'f'), None)
+            self.assertEqual(len(list(pycscope.findSymbol(self.indexfn, 'f'))), 1)
+
+    def testmain(self,):
+        self.assertEqual(pycscope.main(['arg0', 'a.py', 'b.py']), 0)
+        self.assertEqual(pycscope.main(['arg0', 'find', 'f']), 0)
+        # No index, or not one
+        self.assertEqual(pycscope.main(['arg0', 'find', '-f', 'none.out', 'f']), 1)
+        self.assertEqual(pycscope.main(['arg0', 'find', '-f', 'a.py', 'f']), 1)
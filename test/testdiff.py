@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""Unit tests for the diff of two indexes.
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import pycscope
+
+
+class TestDiff(unittest.TestCase):
+
+    def setUp(self,):
+        self.tmpd = tempfile.mkdtemp()
+
+    def tearDown(self,):
+        shutil.rmtree(self.tmpd)
+
+    def index(self, name, files):
+        basepath = os.path.join(self.tmpd, name)
+        os.mkdir(basepath)
+        for fname, contents in files:
+            with open(os.path.join(basepath, fname), "w") as f:
+                f.write(contents)
+        indexfn = os.path.join(self.tmpd, name + '.out')
+        indexbuff, fnamesbuff = pycscope.work(basepath, [fname for fname, contents in files], False)
+        pycscope.saveIndex(basepath, indexfn, indexbuff, fnamesbuff)
+        return indexfn
+
+    def testitersections(self,):
+        indexfn = self.index('a', [('a.py', "import os\n"), ('b.py', "def f():\n    pass\n")])
+        with open(indexfn, 'rb') as f:
+            data = f.read()
+            f.seek(0)
+            ret = list(pycscope.iterSections(f, indexfn, blocksize=7))
+        self.assertEqual([fname for fname, offset, section in ret], ['a.py', 'b.py'])
+        for fname, offset, section in ret:
+            self.assertEqual(data[offset:offset + len(section)], section)
+        self.assertTrue(ret[1][2].startswith(b'\n\t@b.py\n\n1 def \n\t$f\n'))
+
+    def testdiff(self,):
+        oldfn = self.index('old', [('a.py', "import os\n"),
+                                   ('b.py', "def f():\n    g()\n    g()\n"),
+                                   ('c.py', "c = 1\n")])
+        newfn = self.index('new', [('d.py', "d = 1\n"),
+                                   ('b.py', "def h():\n    pass\n\ndef f():\n    g()\n"),
+                                   ('a.py', "import os\n")])
+        ret = list(pycscope.diffIndexes(oldfn, newfn))
+        self.assertEqual(ret, [('+', 'd', '=', 'd.py', 1),
+                               ('-', 'g', '`', 'b.py', 3),
+                               ('+', 'h', '$', 'b.py', 1),
+                               ('-', 'c', '=', 'c.py', 1)])
+        self.assertEqual(list(pycscope.diffIndexes(oldfn, oldfn)), [])
+
+    def testmain(self,):
+        oldfn = self.index('old', [('a.py', "a = 1\n")])
+        newfn = self.index('new', [('a.py', "b = 1\n")])
+        self.assertEqual(pycscope.main(['arg0', 'diff', oldfn, oldfn]), 0)
+        self.assertEqual(pycscope.main(['arg0', 'diff', oldfn, newfn]), 1)
+        self.assertEqual(pycscope.main(['arg0', 'diff', oldfn]), 2)
+        # An index that can't be read is trouble, not a difference
+        self.assertEqual(pycscope.main(['arg0', 'diff', oldfn, os.path.join(self.tmpd, 'none.out')]), 2)
+        with open(newfn, 'w') as f:
+            f.write("cscope 15 . -c 0000000099\n")
+        self.assertEqual(pycscope.main(['arg0', 'diff', oldfn, newfn]), 2)
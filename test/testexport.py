@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Unit tests for exporting and importing an index.
+"""
+
+import unittest
+import json
+import os
+import zipfile
+import tempfile
+import shutil
+import pycscope
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self,):
+        self.tmpd = tempfile.mkdtemp()
+        self.ci = os.path.join(self.tmpd, 'ci')
+        self.local = os.path.join(self.tmpd, 'local')
+        self.archivefn = os.path.join(self.tmpd, 'index.zip')
+        for d in (self.ci, self.local):
+            os.mkdir(d)
+            self.write(d, 'a.py', "a = 1\n")
+            self.write(d, 'b.py', "def b():\n    pass\n")
+            self.write(d, 'c.py', "c = 1\n")
+
+    def tearDown(self,):
+        shutil.rmtree(self.tmpd)
+
+    def write(self, dirname, fname, contents):
+        with open(os.path.join(dirname, fname), "w") as f:
+            f.write(contents)
+
+    def index(self, basepath, fnames):
+        indexfn = os.path.join(basepath, 'cscope.out')
+        records = {}
+        indexbuff, fnamesbuff = pycscope.work(basepath, fnames, False, records=records)
+        pycscope.saveIndex(basepath, indexfn, indexbuff, fnamesbuff)
+        pycscope.writeRecords(indexfn, records)
+        with open(indexfn, 'r') as f:
+            return f.read()
+
+    def testexport(self,):
+        self.index(self.ci, ['a.py', 'b.py', 'c.py'])
+        pycscope.exportIndex(self.ci, os.path.join(self.ci, 'cscope.out'), self.archivefn)
+        with zipfile.ZipFile(self.archivefn) as z:
+            self.assertEqual(sorted(z.namelist()), ['MANIFEST', 'OPTIONS', 'RECORDS', 'cscope.out'])
+            self.assertTrue(z.read('cscope.out').startswith(b'cscope 15 . -c '))
+            manifest = z.read('MANIFEST').decode('utf-8').splitlines()
+        self.assertEqual([line.split('  ')[1] for line in manifest], ['a.py', 'b.py', 'c.py'])
+
+    def testimport(self,):
+        self.index(self.ci, ['a.py', 'b.py', 'c.py'])
+        pycscope.exportIndex(self.ci, os.path.join(self.ci, 'cscope.out'), self.archivefn)
+
+        self.write(self.local, 'b.py', "def b2():\n    pass\n")
+        os.remove(os.path.join(self.local, 'c.py'))
+        indexfn = os.path.join(self.local, 'imported.out')
+        changed = pycscope.importIndex(self.local, self.archivefn, indexfn)
+        self.assertEqual(changed, ['b.py'])
+        with open(indexfn, 'r') as f:
+            ret = f.read()
+        self.assertEqual(ret, self.index(self.local, ['a.py', 'b.py']))
+
+    def testexportindexed(self,):
+        # The manifest has the contents indexed, not those on disk since
+        self.index(self.ci, ['a.py', 'b.py', 'c.py'])
+        self.write(self.ci, 'b.py', "def b2():\n    pass\n")
+        pycscope.exportIndex(self.ci, os.path.join(self.ci, 'cscope.out'), self.archivefn)
+
+        self.write(self.local, 'b.py', "def b2():\n    pass\n")
+        indexfn = os.path.join(self.local, 'imported.out')
+        self.assertEqual(pycscope.importIndex(self.local, self.archivefn, indexfn), ['b.py'])
+        with open(indexfn, 'r') as f:
+            self.assertTrue('\t$b2\n' in f.read())
+        # The records are kept, for the next export
+        self.assertEqual(sorted(pycscope.readRecords(indexfn)), ['a.py', 'b.py', 'c.py'])
+
+    def testexportnorecords(self,):
+        # Without records, files changed since the index are left out
+        self.index(self.ci, ['a.py', 'b.py', 'c.py'])
+        indexfn = os.path.join(self.ci, 'cscope.out')
+        os.remove(indexfn + '.files')
+        for fname in ('a.py', 'c.py'):
+            os.utime(os.path.join(self.ci, fname), (0, 0))
+        self.write(self.ci, 'b.py', "def b2():\n    pass\n")
+        pycscope.exportIndex(self.ci, indexfn, self.archivefn)
+        with zipfile.ZipFile(self.archivefn) as z:
+            self.assertEqual(sorted(z.namelist()), ['MANIFEST', 'OPTIONS', 'cscope.out'])
+            manifest = z.read('MANIFEST').decode('utf-8').splitlines()
+        self.assertEqual([line.split('  ')[1] for line in manifest], ['a.py', 'c.py'])
+
+    def testimportoptions(self,):
+        # Files indexed again get the -S of the index
+        pycscope.strings_as_symbols = True
+        try:
+            self.write(self.ci, 'b.py', "x = 'foo'\n")
+            self.write(self.local, 'b.py', "x = 'baz'\n")
+            self.index(self.ci, ['a.py', 'b.py'])
+            expected = self.index(self.local, ['a.py', 'b.py'])
+        finally:
+            pycscope.strings_as_symbols = False
+        indexfn = os.path.join(self.ci, 'cscope.out')
+        pycscope.exportIndex(self.ci, indexfn, self.archivefn)
+        imported = os.path.join(self.local, 'imported.out')
+        self.assertEqual(pycscope.importIndex(self.local, self.archivefn, imported), ['b.py'])
+        with open(imported, 'r') as f:
+            self.assertEqual(f.read().replace('imported.out', 'cscope.out'), expected)
+        self.assertFalse(pycscope.strings_as_symbols)
+
+        # Without records, -S tells how the index was built
+        os.remove(indexfn + '.files')
+        pycscope.exportIndex(self.ci, indexfn, self.archivefn, True)
+        with zipfile.ZipFile(self.archivefn) as z:
+            self.assertEqual(json.loads(z.read('OPTIONS').decode('utf-8')),
+                             dict(pycscope.buildOptions(), strings=True))
+            members = dict((name, z.read(name)) for name in z.namelist())
+
+        # All the files are indexed again for another version
+        members['OPTIONS'] = b'{"python": [2, 0], "strings": true, "version": "0.1"}'
+        with zipfile.ZipFile(self.archivefn, 'w') as z:
+            for name in members:
+                z.writestr(name, members[name])
+        self.assertEqual(pycscope.importIndex(self.local, self.archivefn, imported), ['a.py', 'b.py'])
+
+    def testmain(self,):
+        self.index(self.ci, ['a.py', 'b.py', 'c.py'])
+        orig_wd = os.getcwd()
+        try:
+            os.chdir(self.ci)
+            self.assertEqual(pycscope.main(['arg0', '--records']), 0)
+            self.assertTrue(os.path.isfile('cscope.out.files'))
+            self.assertEqual(pycscope.main(['arg0', 'export', self.archivefn]), 0)
+            os.chdir(self.local)
+            self.assertEqual(pycscope.main(['arg0', 'import', '-f', 'x.out', self.archivefn]), 0)
+            self.assertEqual(pycscope.main(['arg0', 'import']), 2)
+        finally:
+            os.chdir(orig_wd)
+        self.assertTrue(os.path.isfile(os.path.join(self.local, 'x.out')))
+
+    def testmainerrors(self,):
+        orig_wd = os.getcwd()
+        try:
+            os.chdir(self.local)
+            # No index to export, no archive to import, or a corrupt one
+            self.assertEqual(pycscope.main(['arg0', 'export', self.archivefn]), 1)
+            self.assertEqual(pycscope.main(['arg0', 'import', self.archivefn]), 1)
+            self.write(self.local, 'bad.zip', "not a zip\n")
+            self.assertEqual(pycscope.main(['arg0', 'import', 'bad.zip']), 1)
+            self.write(self.local, 'cscope.out', "not an index\n")
+            self.assertEqual(pycscope.main(['arg0', 'export', self.archivefn]), 1)
+
+            # Directories named like a command can still be indexed
+            os.mkdir('export')
+            self.write(self.local, 'export/e.py', "e = 1\n")
+            self.assertEqual(pycscope.main(['arg0', '-R', '--', 'export']), 0)
+            basepath, sections, fnames = pycscope.readIndex('cscope.out')
+            self.assertEqual(fnames, ['export/e.py'])
+        finally:
+            os.chdir(orig_wd)
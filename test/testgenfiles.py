@@ -38,3 +38,36 @@ class TestGenFiles(unittest.TestCase):
             self.assertEquals(fs, ['a.py', 's/t/f.py', 's/t/e.py', 's/d.py', 's/c.py'])
         finally:
             shutil.rmtree(tmpd)
+
+    def testgenroots(self,):
+        tmpd = tempfile.mkdtemp()
+        try:
+            for root in ('x', 'y'):
+                os.makedirs(os.path.join(tmpd, 'w', root, 'pkg'))
+                with open(os.path.join(tmpd, 'w', root, 'pkg', 'a.py'), "w") as a:
+                    a.write("a = 1\n")
+            roots = [os.path.join(tmpd, 'w', 'x'), os.path.join(tmpd, 'w', 'y', 'pkg')]
+            basepath = pycscope.commonRoot(roots)
+            self.assertEqual(basepath, os.path.join(tmpd, 'w'))
+            self.assertEqual(pycscope.commonRoot(['/']), '/')
+
+            # Files are named from the directory holding all the roots
+            fs = list(pycscope.genRoots(basepath, roots, ['.'], True))
+            self.assertEqual(fs, ['x/pkg/a.py', 'y/pkg/a.py'])
+        finally:
+            shutil.rmtree(tmpd)
+
+    def testgenfilessorted(self,):
+        tmpd = tempfile.mkdtemp()
+        try:
+            for name in ('b.py', 'a.py', 's-t.py', 'c.txt'):
+                with open(os.path.join(tmpd, name), "w") as f:
+                    f.write("x = 1\n")
+            os.mkdir(os.path.join(tmpd, "s"))
+            with open(os.path.join(tmpd, 's', 'd.py'), "w") as d:
+                d.write("d = 1\n")
+
+            fs = list(pycscope.genFiles(tmpd, ['.'], True, sort=True))
+            self.assertEqual(fs, ['./a.py', './b.py', './s/d.py', './s-t.py'])
+        finally:
+            shutil.rmtree(tmpd)
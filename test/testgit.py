@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""Unit tests for the git aware incremental builds.
+"""
+
+import unittest
+import json
+import os
+import subprocess
+import tempfile
+import shutil
+import pycscope
+
+
+class TestGit(unittest.TestCase):
+
+    def setUp(self,):
+        self.orig_wd = os.getcwd()
+        self.tmpd = tempfile.mkdtemp()
+        os.chdir(self.tmpd)
+        os.makedirs(os.path.join(self.tmpd, 'pkg'))
+        self.write('a.py', "def a():\n    pass\n")
+        self.write('pkg/b.py', "b = 1\n")
+        self.write('pkg/c.py', "c = 1\n")
+        self.git('init', '-q')
+        self.git('add', 'a.py', 'pkg')
+        self.git('-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-q', '-m', 'x')
+
+    def tearDown(self,):
+        os.chdir(self.orig_wd)
+        shutil.rmtree(self.tmpd)
+
+    def git(self, *args):
+        with open(os.devnull, 'w') as null:
+            subprocess.check_call(('git',) + args, cwd=self.tmpd, stdout=null)
+
+    def write(self, fname, contents):
+        with open(os.path.join(self.tmpd, fname), "w") as f:
+            f.write(contents)
+
+    def read(self, fname):
+        with open(os.path.join(self.tmpd, fname), 'rb') as f:
+            return f.read()
+
+    def testargsname(self,):
+        self.assertEqual(pycscope.argsName(['.'], True, 'pkg/b.py'), './pkg/b.py')
+        self.assertEqual(pycscope.argsName(['.'], False, 'pkg/b.py'), None)
+        self.assertEqual(pycscope.argsName(['pkg/', 'a.py'], False, 'a.py'), 'a.py')
+        self.assertEqual(pycscope.argsName(['pkg/', 'a.py'], False, 'pkg/b.py'), 'pkg/b.py')
+        self.assertEqual(pycscope.argsName(['x.whl'], False, 'x.whl/m.py'), 'x.whl/m.py')
+        self.assertEqual(pycscope.argsName(['pkg'], True, 'pkg/b.txt'), None)
+
+    def testgitupdate(self,):
+        self.assertEqual(pycscope.main(['arg0', '--git', '-R']), 0)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpd, 'cscope.out.git')))
+        self.write('pkg/b.py', "b = 2\ndef d():\n    pass\n")
+        self.write('pkg/e.py', "e = 1\n")
+        os.remove(os.path.join(self.tmpd, 'pkg/c.py'))
+        self.assertEqual(pycscope.main(['arg0', '--git', '-R']), 0)
+        ret = self.read('cscope.out')
+
+        os.remove(os.path.join(self.tmpd, 'cscope.out.git'))
+        self.assertEqual(pycscope.main(['arg0', '-R', '-f', 'full.out']), 0)
+        full = self.read('full.out')
+        # Reused sections keep their place, new files come last
+        _, sections, fnames = pycscope.readIndex(os.path.join(self.tmpd, 'cscope.out'))
+        self.assertEqual(sorted(fnames), ['./a.py', './pkg/b.py', './pkg/e.py'])
+        self.assertEqual(fnames[-1], './pkg/e.py')
+        self.assertEqual(sorted(ret.split(b'\n\t@')[1:-1]), sorted(full.split(b'\n\t@')[1:-1]))
+
+    def testgitreuse(self,):
+        self.assertEqual(pycscope.main(['arg0', '--git', '-R']), 0)
+        # Files git is told are unchanged are not read again
+        self.write('a.py', "def z():\n    pass\n")
+        self.git('update-index', '--assume-unchanged', 'a.py')
+        self.assertEqual(pycscope.main(['arg0', '--git', '-R']), 0)
+        ret = self.read('cscope.out')
+        self.assertTrue(b'\t$a\n' in ret)
+        self.assertFalse(b'\t$z\n' in ret)
+
+        # Other options build the index in full
+        self.assertEqual(pycscope.main(['arg0', '--git', '-R', 'a.py', 'pkg']), 0)
+        self.assertEqual(pycscope.main(['arg0', '--git', '-R']), 0)
+        ret = self.read('cscope.out')
+        self.assertTrue(b'\t$z\n' in ret)
+
+    def testrev(self,):
+        self.git('tag', 'v1')
+        self.write('pkg/b.py', "def b():\n    pass\n")
+        self.git('-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-q', '-a', '-m', 'y')
+        self.write('a.py', "z = 1\n")
+        os.remove(os.path.join(self.tmpd, 'pkg/c.py'))
+
+        # Read from the revision, not the work tree
+        self.assertEqual(pycscope.main(['arg0', '-R', '--rev=v1']), 0)
+        ret = self.read('cscope.out')
+        self.assertTrue(b'\t$a\n' in ret)
+        self.assertFalse(b'\t$b\n' in ret)
+        self.assertTrue(b'\n\t@./pkg/c.py\n' in ret)
+        state = json.loads(self.read('cscope.out.blobs').decode('utf-8'))
+        self.assertEqual(sorted(state['blobs']), ['./a.py', './pkg/b.py', './pkg/c.py'])
+
+        # Only the blobs not in the index are parsed
+        stats = pycscope.Stats()
+        indexbuff, fnamesbuff, blobs = pycscope.revIndex(self.tmpd, os.path.join(self.tmpd, 'cscope.out'),
+                                                         'HEAD', ['.'], True, False, stats=stats)
+        self.assertEqual(stats.parsed, 1)
+        self.assertEqual(fnamesbuff, ['./a.py', './pkg/b.py', './pkg/c.py'])
+        index = ''.join(indexbuff)
+        self.assertTrue('\t$a\n' in index)
+        self.assertTrue('\t$b\n' in index)
+        self.assertTrue('\n\t@./pkg/c.py\n' in index)
+
+        # Sections made without -S are not reused with it
+        pycscope.strings_as_symbols = True
+        try:
+            stats = pycscope.Stats()
+            pycscope.revIndex(self.tmpd, os.path.join(self.tmpd, 'cscope.out'), 'HEAD', ['.'], True, False,
+                              stats=stats)
+            self.assertEqual(stats.parsed, 3)
+        finally:
+            pycscope.strings_as_symbols = False
+
+        self.assertEqual(pycscope.main(['arg0', '-R', '--rev=nosuchrev']), 1)
+        # A work tree index forgets the blobs
+        self.assertEqual(pycscope.main(['arg0', '-R']), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpd, 'cscope.out.blobs')))
+
+    def testgitreproducible(self,):
+        self.assertEqual(pycscope.main(['arg0', '--git', '--reproducible', '-R']), 0)
+        os.makedirs(os.path.join(self.tmpd, 'a'))
+        self.write('a/z.py', "z = 1\n")
+        self.write('pkg/a.py', "a = 1\n")
+        self.assertEqual(pycscope.main(['arg0', '--git', '--reproducible', '-R']), 0)
+        ret = self.read('cscope.out')
+        self.assertTrue(ret.startswith(b'cscope 15 . -c '))
+
+        # The same as a full build, byte for byte
+        self.assertEqual(pycscope.main(['arg0', '--reproducible', '-R', '-f', 'full.out']), 0)
+        self.assertEqual(ret, self.read('full.out'))
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Unit tests for the graph export.
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import pycscope
+
+
+class TestGraph(unittest.TestCase):
+
+    def setUp(self,):
+        self.tmpd = tempfile.mkdtemp()
+
+    def tearDown(self,):
+        shutil.rmtree(self.tmpd)
+
+    def testiterindexlines(self,):
+        rows = '\n\t@a.py\n\n1 import \n\t~os.path\n\n2 \n\t=a\n = \n\t`foo\n ( \nb\n )\n\n'.split('\n')
+        ret = list(pycscope.iterIndexLines(rows))
+        self.assertEqual(ret, [(1, 'import os.path', [('~', 'os.path')]),
+                               (2, 'a = foo ( b )', [('=', 'a'), ('`', 'foo'), ('', 'b')])])
+
+    def testgraph(self,):
+        with open(os.path.join(self.tmpd, 'a.py'), "w") as a:
+            a.write("import os\n"
+                    "def f():\n"
+                    "    g()\n"
+                    "    return h.i()\n"
+                    "g()\n")
+        gfn = os.path.join(self.tmpd, 'graph')
+        sink = pycscope.GraphWriter(gfn)
+        pycscope.work(self.tmpd, ['a.py'], False, [sink])
+        sink.close()
+
+        calls, includes = pycscope.readGraph(gfn)
+        self.assertEqual(calls, [('a.py', 'f', 'g'), ('a.py', 'f', 'i'), ('a.py', 'a.py', 'g')])
+        self.assertEqual(includes, [('a.py', 'os')])
+
+    def testgraphrelative(self,):
+        # Relative imports keep their level
+        with open(os.path.join(self.tmpd, 'b.py'), "w") as b:
+            b.write("from .sub import c\n"
+                    "from . import (d,\n"
+                    "    e as f)\n"
+                    "import sub\n"
+                    "from ..x.y import z\n")
+        gfn = os.path.join(self.tmpd, 'graph')
+        sink = pycscope.GraphWriter(gfn)
+        pycscope.work(self.tmpd, ['b.py'], False, [sink])
+        sink.close()
+
+        calls, includes = pycscope.readGraph(gfn)
+        self.assertEqual(includes, [('b.py', '.sub'), ('b.py', '.d'), ('b.py', '.e'), ('b.py', 'sub'),
+                                    ('b.py', '..x.y')])
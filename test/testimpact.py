@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""Unit tests for the change impact analysis.
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import pycscope
+
+
+class TestImpact(unittest.TestCase):
+
+    def setUp(self,):
+        self.tmpd = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpd, 'pkg'))
+        self.write('pkg/__init__.py', "")
+        self.write('pkg/a.py', "import os\n")
+        self.write('pkg/b.py', "import pkg.a\n")
+        self.write('c.py', "from pkg.b import f\n")
+        self.write('test_c.py', "import c\n")
+        self.write('d.py', "import pkg\n")
+        self.indexfn = os.path.join(self.tmpd, 'cscope.out')
+        fnames = ['pkg/__init__.py', 'pkg/a.py', 'pkg/b.py', 'c.py', 'test_c.py', 'd.py']
+        indexbuff, fnamesbuff = pycscope.work(self.tmpd, fnames, False)
+        pycscope.saveIndex(self.tmpd, self.indexfn, indexbuff, fnamesbuff)
+
+    def tearDown(self,):
+        shutil.rmtree(self.tmpd)
+
+    def write(self, fname, contents):
+        with open(os.path.join(self.tmpd, fname), "w") as f:
+            f.write(contents)
+
+    def testresolveinclude(self,):
+        modules = {'pkg': 'pkg/__init__.py', 'pkg.a': 'pkg/a.py'}
+        self.assertEqual(pycscope.resolveInclude(modules, 'pkg.a'), ['pkg/__init__.py', 'pkg/a.py'])
+        self.assertEqual(pycscope.resolveInclude(modules, 'os.path'), [])
+
+    def testimpact(self,):
+        graph = pycscope.importGraph(self.indexfn)
+        self.assertEqual(graph['pkg/a.py'], ['pkg/b.py'])
+        self.assertEqual(pycscope.impactedFiles(graph, ['./pkg/a.py']),
+                         ['c.py', 'pkg/a.py', 'pkg/b.py', 'test_c.py'])
+        self.assertEqual(pycscope.impactedFiles(graph, ['pkg/__init__.py']),
+                         ['c.py', 'd.py', 'pkg/__init__.py', 'pkg/b.py', 'test_c.py'])
+        self.assertEqual(pycscope.impactedFiles(graph, ['e.py']), [])
+
+        # The graph is read back from the cache
+        self.assertTrue(os.path.isfile(self.indexfn + '.impact'))
+        self.assertEqual(pycscope.importGraph(self.indexfn), graph)
+
+        # Unless the index is built again, even to the same size right after
+        self.write('test_c.py', "import d\n")
+        fnames = ['pkg/__init__.py', 'pkg/a.py', 'pkg/b.py', 'c.py', 'test_c.py', 'd.py']
+        indexbuff, fnamesbuff = pycscope.work(self.tmpd, fnames, False)
+        pycscope.saveIndex(self.tmpd, self.indexfn, indexbuff, fnamesbuff)
+        graph = pycscope.importGraph(self.indexfn)
+        self.assertEqual(graph['c.py'], [])
+        self.assertEqual(graph['d.py'], ['test_c.py'])
+
+    def testparseimports(self,):
+        self.assertEqual(pycscope.parseImports("import a.b as q , c"), [(0, 'a.b', []), (0, 'c', [])])
+        self.assertEqual(pycscope.parseImports("from . . a.b import ( c , d as e )"), [(2, 'a.b', ['c', 'd'])])
+        self.assertEqual(pycscope.parseImports("from ... import x"), [(3, '', ['x'])])
+        self.assertEqual(pycscope.parseImports("if x : import y ; z = 1"), [(0, 'y', [])])
+        self.assertEqual(pycscope.parseImports("imported = 1"), [])
+
+    def testresolveimport(self,):
+        modules = {'pkg': 'pkg/__init__.py', 'pkg.a': 'pkg/a.py', 'pkg.sub.b': 'pkg/sub/b.py'}
+        self.assertEqual(pycscope.resolveImport(modules, ['pkg', 'sub'], 2, 'a', []), ['pkg/__init__.py', 'pkg/a.py'])
+        self.assertEqual(pycscope.resolveImport(modules, ['pkg', 'sub'], 1, '', ['b', 'c']), ['pkg/__init__.py', 'pkg/sub/b.py'])
+        self.assertEqual(pycscope.resolveImport(modules, ['pkg'], 3, 'a', []), [])
+        self.assertEqual(pycscope.resolveImport(modules, ['pkg'], 2, '', ['a']), [])
+        self.assertEqual(pycscope.resolveImport(modules, None, 1, 'a', []), [])
+        self.assertEqual(pycscope.resolveImport(modules, [], 0, 'pkg', ['a']), ['pkg/__init__.py', 'pkg/a.py'])
+
+    def testincludes(self,):
+        os.makedirs(os.path.join(self.tmpd, 'src', 'lib'))
+        self.write('src/lib/__init__.py', "from . import util\n")
+        self.write('src/lib/util.py', "from .. import pkg\nimport pkg.a\n")
+        fnames = ['src/lib/__init__.py', 'src/lib/util.py', 'pkg/__init__.py', 'pkg/a.py', 'test_c.py']
+        indexbuff, fnamesbuff = pycscope.work(self.tmpd, fnames, False)
+        pycscope.saveIndex(self.tmpd, self.indexfn, indexbuff, fnamesbuff)
+        tablefn = os.path.join(self.tmpd, 'includes')
+        pycscope.writeIncludes(self.indexfn, tablefn, ['src', '.'])
+        with open(tablefn) as f:
+            self.assertEqual(f.read().splitlines(),
+                             ['src/lib/__init__.py\t1\t.\tsrc/lib/__init__.py\tsrc/lib/util.py',
+                              'src/lib/util.py\t1\t..',
+                              'src/lib/util.py\t2\tpkg.a\tpkg/__init__.py\tpkg/a.py',
+                              'pkg/a.py\t1\tos',
+                              'test_c.py\t1\tc'])
+        includers = pycscope.readIncludes(tablefn)
+        self.assertEqual(includers['pkg/a.py'], [('src/lib/util.py', 2)])
+
+        # Relative imports within the roots
+        graph = pycscope.importGraph(self.indexfn, ['src', '.'])
+        self.assertEqual(graph['src/lib/util.py'], ['src/lib/__init__.py'])
+
+    def testcontinued(self,):
+        self.write('e.py', "from pkg import (\n    a,\n    b as c,\n)\n")
+        self.write('f.py', "import os, \\\n    pkg.b\nfrom pkg import \\\n    a\n")
+        fnames = ['pkg/__init__.py', 'pkg/a.py', 'pkg/b.py', 'e.py', 'f.py']
+        records = {}
+        indexbuff, fnamesbuff = pycscope.work(self.tmpd, fnames, False, records=records)
+        self.assertEqual(records['e.py']['imports'], [(1, 0, 'pkg', ['a', 'b'])])
+        pycscope.saveIndex(self.tmpd, self.indexfn, indexbuff, fnamesbuff)
+        pycscope.writeRecords(self.indexfn, records)
+
+        # The names imported by statements over several lines are submodules
+        # too
+        graph = pycscope.importGraph(self.indexfn)
+        self.assertEqual(graph['pkg/a.py'], ['e.py', 'f.py', 'pkg/b.py'])
+        self.assertEqual(graph['pkg/b.py'], ['e.py', 'f.py'])
+        self.assertEqual([(fname, lineno, include) for fname, lineno, include, imported
+                          in pycscope.resolveIncludes(self.indexfn) if fname == 'f.py'],
+                         [('f.py', 1, 'os'), ('f.py', 1, 'pkg.b'), ('f.py', 3, 'pkg')])
+
+    def testmain(self,):
+        orig_wd = os.getcwd()
+        try:
+            os.chdir(self.tmpd)
+            self.assertEqual(pycscope.main(['arg0', 'impact', 'pkg/b.py']), 0)
+            # No index, or not one
+            self.assertEqual(pycscope.main(['arg0', 'impact', '-f', 'none.out', 'pkg/b.py']), 1)
+            self.assertEqual(pycscope.main(['arg0', 'impact', '-f', 'c.py', 'pkg/b.py']), 1)
+        finally:
+            os.chdir(orig_wd)
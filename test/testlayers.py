@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""Unit tests for the prebuilt distribution indexes.
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import pycscope
+
+
+class TestLayers(unittest.TestCase):
+
+    def setUp(self,):
+        self.tmpd = tempfile.mkdtemp()
+        self.site = os.path.join(self.tmpd, 'site')
+        self.cache = os.path.join(self.tmpd, 'cache')
+        os.makedirs(os.path.join(self.site, 'foo'))
+        os.makedirs(os.path.join(self.site, 'Foo_Bar-1.0.dist-info'))
+        self.write('foo/__init__.py', "def f():\n    pass\n")
+        self.write('foo/bad.py', "a a (b)\n")
+        self.write('Foo_Bar-1.0.dist-info/RECORD',
+                   "foo/__init__.py,sha256=x,18\n"
+                   "foo/bad.py,sha256=x,8\n"
+                   "Foo_Bar-1.0.dist-info/RECORD,,\n"
+                   "../../bin/foo,sha256=x,10\n")
+
+    def tearDown(self,):
+        shutil.rmtree(self.tmpd)
+
+    def write(self, fname, contents):
+        with open(os.path.join(self.site, fname), "w") as f:
+            f.write(contents)
+
+    def testfinddistribution(self,):
+        dist = pycscope.findDistribution('foo-bar', [self.site])
+        self.assertEqual((dist.name, dist.version, dist.root), ('Foo_Bar', '1.0', self.site))
+        self.assertEqual(dist.fnames, ['foo/__init__.py', 'foo/bad.py'])
+        self.assertEqual(pycscope.findDistribution('foo', [self.site]), None)
+
+    def testreadindex(self,):
+        indexbuff, fnamesbuff = pycscope.work(self.site, ['foo/__init__.py', 'foo/bad.py'], False)
+        index = ''.join(indexbuff)
+        indexfn = os.path.join(self.tmpd, 'cscope.out')
+        pycscope.saveIndex(self.site, indexfn, indexbuff, fnamesbuff)
+        basepath, sections, fnames = pycscope.readIndex(indexfn)
+        self.assertEqual(basepath, self.site)
+        self.assertEqual([fname for fname, section in sections], ['foo/__init__.py', 'foo/bad.py'])
+        self.assertEqual(''.join(section for fname, section in sections), index)
+        self.assertEqual(fnames, ['foo/__init__.py', 'foo/bad.py'])
+
+    def testlayerindex(self,):
+        dist = pycscope.findDistribution('foo_bar', [self.site])
+        sections, fnames = pycscope.layerIndex(dist, self.cache)
+        fullpath = os.path.join(self.site, 'foo/__init__.py')
+        self.assertTrue(os.path.isfile(os.path.join(self.cache, pycscope.layerKey(dist) + '.out')))
+        self.assertEqual(fnames, [fullpath, os.path.join(self.site, 'foo/bad.py')])
+        self.assertEqual(sections[0], '\n\t@%s\n\n' % fullpath)
+        self.assertTrue('\t$f\n' in sections[1])
+
+        # The prebuilt index is reused as is
+        self.write('foo/__init__.py', "def g():\n    pass\n")
+        self.assertEqual(pycscope.layerIndex(dist, self.cache), (sections, fnames))
+
+        # But not with other options
+        pycscope.strings_as_symbols = True
+        try:
+            self.assertTrue(pycscope.layerKey(dist).endswith('-S'))
+            self.assertTrue('\t$g\n' in pycscope.layerIndex(dist, self.cache)[0][1])
+        finally:
+            pycscope.strings_as_symbols = False
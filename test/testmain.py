@@ -4,6 +4,8 @@
 
 import unittest
 import os
+import sys
+import subprocess
 import tempfile
 import shutil
 import pycscope
@@ -47,6 +49,15 @@ class TestMain(unittest.TestCase):
         ret = os.listdir(self.tmpd)
         assert [] == ret, "Expected [], got %r" % ret
 
+    def testmaindashVlazy(self,):
+        # Neither the parser nor the modules of other commands are loaded
+        script = ("import sys, pycscope; pycscope.main(['arg0', '-V']); "
+                  "print(sorted(m for m in ('parser', 'symbol', 'getopt', 'zipfile', 'tarfile', 'hashlib') "
+                  "if m in sys.modules))")
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(pycscope.__file__))))
+        ret = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, env=env).communicate()[0]
+        self.assertEqual(ret.decode('ascii').splitlines()[-1], "[]")
+
     def testmaindashD(self,):
         ret = pycscope.main(['arg0', '-D'])
         assert 0 == ret, "Expected 0, got %r" % ret
@@ -94,3 +105,17 @@ class TestMain(unittest.TestCase):
             contents = c.read()
         econtents = 'cscope 15 %s -c 0000000116\n\t@./d/c.py\n\n1 \n\t=c\n = 3\n\n\n\t@./b.py\n\n1 \n\t=b\n = 2\n\n\n\t@./a.py\n\n1 \n\t=a\n = 1\n\n\n\t@\n1\n.\n0\n3\n23\n./d/c.py\n./b.py\n./a.py\n' % self.tmpd
         assert econtents == contents, "Expected %r, got %r" % (econtents, contents)
+
+    def testmainroots(self,):
+        for root in ('x', 'y'):
+            os.mkdir(os.path.join(self.tmpd, root))
+            with open(os.path.join(self.tmpd, root, 'a.py'), 'w') as a:
+                a.write('%s = 1\n' % root)
+        os.chdir(os.path.join(self.tmpd, 'x'))
+        ret = pycscope.main(['arg0', '--root=.', '--root=../y', '-f', '../cscope.out'])
+        assert 0 == ret, "Expected 0, got %r" % ret
+        basepath, sections, fnames = pycscope.readIndex(os.path.join(self.tmpd, 'cscope.out'))
+        self.assertEqual(basepath, os.path.realpath(self.tmpd))
+        self.assertEqual(fnames, ['x/a.py', 'y/a.py'])
+        self.assertEqual(pycscope.main(['arg0', '--root=../z']), 1)
+        self.assertEqual(pycscope.main(['arg0', '--root=.', '--git']), 2)
@@ -35,3 +35,24 @@ class TestParseFile(unittest.TestCase):
             self.assertEquals(os.path.join(cwd, fn), e.filename)
         else:
             self.fail("Expected a syntax error.")
+
+    def testdecoding(self,):
+        # Verify DOS line endings and coding cookies are handled on reading
+        self.assertEqual(pycscope.decodeSource(b"a = 1\r\nb = 2\r\n"), "a = 1\nb = 2\n")
+        self.assertEqual(pycscope.decodeSource(b"a = 1\rb = 2\r\r\nc = 3"), "a = 1\nb = 2\n\nc = 3")
+        src = b"# -*- coding: latin-1 -*-\ns = '\xe9'\n"
+        if sys.hexversion < 0x03000000:
+            self.assertEqual(pycscope.decodeSource(src), src)
+        else:
+            self.assertEqual(pycscope.decodeSource(src), src.decode('latin-1'))
+            self.assertEqual(pycscope.decodeSource(b"\xef\xbb\xbfa = 1\n"), "a = 1\n")
+
+    def testundecodable(self,):
+        if sys.hexversion < 0x03000000:
+            return
+        try:
+            pycscope.decodeSource(b"s = '\xe9'\n")
+        except UnicodeError:
+            pass
+        else:
+            self.fail("Expected a unicode error.")
@@ -1531,3 +1531,28 @@ class TestParseSource(unittest.TestCase):
                      '\t$print',
                      ' ( ) : return 0',
                      ''])
+
+    def testContextRecord(self,):
+        # The lines and symbols recorded are those of the buffer
+        src = ("import a.b\n"
+               "class C(object):\n"
+               "    def m(self): return f(x) ; y = 1\n"
+               "def g():\n"
+               "    pass\n")
+        ctx = pycscope.Context(keep=True)
+        parseSource(src, self.buf, 0, ctx=ctx)
+        lines = []
+        symbols = []
+        for lineno, text, syms in pycscope.iterIndexLines("".join(self.buf).split("\n")):
+            lines.append((lineno, text))
+            symbols.extend((mark, name, lineno) for mark, name in syms)
+        self.assertEqual(ctx.lines, lines)
+        self.assertEqual([s[:3] for s in ctx.symbols], symbols)
+        self.assertEqual([(name, func) for mark, name, lineno, func in ctx.symbols if lineno < 3],
+                         [('a.b', None), ('C', None), ('object', None)])
+        self.assertEqual([func for mark, name, lineno, func in ctx.symbols if name == 'x'], ['m'])
+
+        # Nor kept unless asked for
+        ctx = pycscope.Context()
+        parseSource(src, [], 0, ctx=ctx)
+        self.assertEqual((ctx.lines, ctx.symbols), ([], []))
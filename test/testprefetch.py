@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""Unit tests for prefetchFiles.
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import pycscope
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self,):
+        self.tmpd = tempfile.mkdtemp()
+        self.fnames = []
+        for i in range(20):
+            fname = 'f%d.py' % i
+            with open(os.path.join(self.tmpd, fname), "w") as f:
+                f.write("f%d = 1\n" % i)
+            self.fnames.append(fname)
+
+    def tearDown(self,):
+        shutil.rmtree(self.tmpd)
+
+    def testorder(self,):
+        fnames = self.fnames + ['_does_not_exist_.py']
+        ret = list(pycscope.prefetchFiles(self.tmpd, iter(fnames), 3, depth=2))
+        self.assertEqual([r[0] for r in ret], fnames)
+        self.assertEqual(ret[7][1], b"f7 = 1\n")
+        self.assertEqual(ret[-1][1], None)
+
+    def testwork(self,):
+        expected = pycscope.work(self.tmpd, self.fnames, False)
+        ret = pycscope.work(self.tmpd, iter(self.fnames), False, prefetch=4)
+        self.assertEqual(ret, expected)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Unit tests for scope tracking.
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import pycscope
+
+
+class TestScopes(unittest.TestCase):
+
+    def definitions(self, src):
+        ctx = pycscope.Context()
+        pycscope.parseSource(src, [], 0, ctx=ctx)
+        return ctx.definitions
+
+    def testnested(self,):
+        src = ("class A(object):\n"
+               "    x = 1\n"
+               "    def run(self):\n"
+               "        y = 2\n"
+               "        def inner():\n"
+               "            pass\n"
+               "        if y:\n"
+               "            pass\n"
+               "    def stop(self): return 1\n"
+               "    z = 3\n"
+               "def run():\n"
+               "    global g\n"
+               "b = 4\n")
+        self.assertEqual(self.definitions(src), [
+            ('A', 'c', 1), ('A.x', '=', 2), ('A.run', '$', 3), ('A.run.inner', '$', 5),
+            ('A.stop', '$', 9), ('A.z', '=', 10), ('run', '$', 11), ('g', 'g', 12),
+            ('b', '=', 13)])
+
+    def testoneline(self,):
+        src = ("class A: x = 1\n"
+               "y = 2\n")
+        self.assertEqual(self.definitions(src), [('A', 'c', 1), ('A.x', '=', 1), ('y', '=', 2)])
+
+    def testmodulename(self,):
+        self.assertEqual(pycscope.moduleName('./pkg/__init__.py'), 'pkg')
+        self.assertEqual(pycscope.moduleName('pkg/mod.py'), 'pkg.mod')
+        self.assertEqual(pycscope.moduleName('mod.py'), 'mod')
+
+    def testscopewriter(self,):
+        tmpd = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(tmpd, 'p'))
+            with open(os.path.join(tmpd, 'p', 'm.py'), "w") as m:
+                m.write("class A:\n    def run(self):\n        pass\n")
+            sfn = os.path.join(tmpd, 'scopes')
+            sink = pycscope.ScopeWriter(sfn)
+            pycscope.work(tmpd, ['p/m.py'], False, [sink])
+            sink.close()
+            with open(sfn, 'r') as f:
+                ret = f.read()
+            self.assertEqual(ret, 'p.m.A\tc\tp/m.py\t1\np.m.A.run\t$\tp/m.py\t2\n')
+        finally:
+            shutil.rmtree(tmpd)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""Unit tests for the SQLite output.
+"""
+
+import unittest
+import os
+import sqlite3
+import tempfile
+import shutil
+import pycscope
+
+
+class TestSqlite(unittest.TestCase):
+
+    def setUp(self,):
+        self.tmpd = tempfile.mkdtemp()
+        self.dbfn = os.path.join(self.tmpd, 'cscope.db')
+
+    def tearDown(self,):
+        shutil.rmtree(self.tmpd)
+
+    def write(self, fname, contents):
+        with open(os.path.join(self.tmpd, fname), "w") as f:
+            f.write(contents)
+
+    def index(self, fnames, prune=True):
+        sink = pycscope.SqliteWriter(self.dbfn, batch=1, prune=prune)
+        pycscope.work(self.tmpd, fnames, False, [sink])
+        sink.close()
+
+    def query(self, sql, *args):
+        db = sqlite3.connect(self.dbfn)
+        try:
+            return [tuple(row) for row in db.execute(sql, args)]
+        finally:
+            db.close()
+
+    def testsqlite(self,):
+        self.write('a.py', "def f():\n    g()\n")
+        self.write('b.py', "b = 1\n")
+        self.index(['a.py', 'b.py'])
+
+        ret = self.query("SELECT path FROM files ORDER BY path")
+        self.assertEqual(ret, [('a.py',), ('b.py',)])
+        ret = self.query("SELECT f.path, s.lineno, s.func FROM symbols s, files f"
+                         " WHERE s.file_id = f.id AND s.name = ? AND s.mark = ?", 'g', '`')
+        self.assertEqual(ret, [('a.py', 2, 'f')])
+        ret = self.query("SELECT text FROM lines WHERE lineno = 1 ORDER BY text")
+        self.assertEqual(ret, [('b = 1',), ('def f ( ) :',)])
+
+    def testupsert(self,):
+        self.write('a.py', "a = 1\n")
+        self.write('b.py', "b = 1\n")
+        self.index(['a.py', 'b.py'])
+        self.write('a.py', "c = 1\n")
+        self.index(['a.py'], prune=False)
+
+        ret = self.query("SELECT f.path, s.name FROM symbols s, files f"
+                         " WHERE s.file_id = f.id ORDER BY f.path")
+        self.assertEqual(ret, [('a.py', 'c'), ('b.py', 'b')])
+
+    def testprune(self,):
+        self.write('a.py', "a = 1\n")
+        self.write('b.py', "b = 1\n")
+        self.index(['a.py', 'b.py'])
+        # Files gone, or no longer parsing, are removed
+        self.write('a.py', "a = (\n")
+        os.remove(os.path.join(self.tmpd, 'b.py'))
+        self.write('c.py', "c = 1\n")
+        self.index(['a.py', 'b.py', 'c.py'])
+
+        self.assertEqual(self.query("SELECT path FROM files"), [('c.py',)])
+        self.assertEqual(self.query("SELECT name FROM symbols"), [('c',)])
+        self.assertEqual(self.query("SELECT text FROM lines"), [('c = 1',)])
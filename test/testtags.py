@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""Unit tests for the ctags and etags output.
+"""
+
+import unittest
+import os
+import tempfile
+import shutil
+import pycscope
+
+
+class TestTags(unittest.TestCase):
+
+    def setUp(self,):
+        self.tmpd = tempfile.mkdtemp()
+        with open(os.path.join(self.tmpd, 'a.py'), "w") as a:
+            a.write("class B(object):\n"
+                    "    pass\n"
+                    "def  a():\n"
+                    "    global z\n"
+                    "    z = 1\n")
+        self.tagsfn = os.path.join(self.tmpd, 'tags')
+
+    def tearDown(self,):
+        shutil.rmtree(self.tmpd)
+
+    def index(self, sink):
+        pycscope.work(self.tmpd, ['a.py'], False, [sink])
+        sink.close()
+        with open(self.tagsfn, 'rb') as f:
+            return f.read().decode('utf-8')
+
+    def testctags(self,):
+        ret = self.index(pycscope.TagsWriter(self.tagsfn))
+        lines = [l for l in ret.splitlines() if not l.startswith('!_TAG_')]
+        self.assertEqual(lines, ['B\ta.py\t1;"\tc', 'a\ta.py\t3;"\tf', 'z\ta.py\t4;"\tv'])
+
+    def testetags(self,):
+        ret = self.index(pycscope.TagsWriter(self.tagsfn, emacs=True))
+        # The patterns are prefixes of the source lines, as they are
+        body = 'class B\x7fB\x011,\ndef  a\x7fa\x013,\n    global z\x7fz\x014,\n'
+        self.assertEqual(ret, '\x0c\na.py,%d\n%s' % (len(body), body))
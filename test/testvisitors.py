@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Unit tests for the analyses run by visitors of the CST walk.
+"""
+
+import unittest
+import os
+import sys
+import tempfile
+import shutil
+import pycscope
+
+
+class Collector(object):
+    # A sink keeping the results of the analyses of each file
+
+    def __init__(self):
+        self.results = {}
+
+    def add(self, relpath, ctx):
+        self.results[relpath] = dict(ctx.results)
+
+    def close(self):
+        pass
+
+
+def register(visitors):
+    # Collect the lines setting __all__, and the calls of deprecated()
+    def name(ctx, node):
+        if node[1] == '__all__':
+            ctx.results.setdefault('__all__', []).append(node[2])
+
+    def call(ctx, name, lineno):
+        if name == 'deprecated':
+            ctx.results.setdefault('deprecated', []).append(lineno)
+
+    visitors.onNode('NAME', name)
+    visitors.onMark(pycscope.Mark.FUNC_CALL, call)
+    return [Collector()]
+
+
+class TestVisitors(unittest.TestCase):
+
+    def setUp(self,):
+        self.tmpd = tempfile.mkdtemp()
+        self.write('a.py', "__all__ = ['f']\n"
+                           "def f():\n"
+                           "    deprecated()\n"
+                           "    return g()\n")
+        self.write('b.py', "x = 1\n")
+
+    def tearDown(self,):
+        shutil.rmtree(self.tmpd)
+
+    def write(self, fname, contents):
+        with open(os.path.join(self.tmpd, fname), "w") as f:
+            f.write(contents)
+
+    def testvisitors(self,):
+        visitors = pycscope.Visitors()
+        sink, = register(visitors)
+        plain = pycscope.work(self.tmpd, ['a.py', 'b.py', 'a.py'], False)
+        ret = pycscope.work(self.tmpd, ['a.py', 'b.py', 'a.py'], False, [sink], visitors=visitors)
+        # The index is the same, and duplicates get the results too
+        self.assertEqual(ret, plain)
+        self.assertEqual(sink.results, {'a.py': {'__all__': [1], 'deprecated': [3]},
+                                        'b.py': {}})
+
+    def testcallbackerror(self,):
+        # A callback raising an error fails its file only
+        def name(ctx, node):
+            if node[1] == 'x':
+                raise KeyError(node[1])
+
+        def define(ctx, name, lineno):
+            if name == 'h':
+                raise ValueError("bad %s" % name)
+
+        class Failures(object):
+            def __init__(self):
+                self.errors = []
+
+            def started(self, relpath):
+                pass
+
+            def finished(self, relpath, size, index_size, seconds):
+                pass
+
+            def failed(self, relpath, message):
+                self.errors.append((relpath, message))
+
+        self.write('c.py', "def h():\n    pass\n")
+        visitors = pycscope.Visitors()
+        visitors.onNode('NAME', name)
+        visitors.onMark(pycscope.Mark.FUNC_DEF, define)
+        stats = pycscope.Stats()
+        events = Failures()
+        indexbuff, fnamesbuff = pycscope.work(self.tmpd, ['b.py', 'c.py', 'a.py'], False, stats=stats,
+                                              events=[events], visitors=visitors)
+        self.assertEqual(fnamesbuff, ['b.py', 'c.py', 'a.py'])
+        self.assertEqual(stats.errors, 2)
+        self.assertEqual(events.errors, [('b.py', "Line 1: name: KeyError: 'x'"),
+                                         ('c.py', "Line 1: define: ValueError: bad h")])
+        # The file after them is indexed
+        self.assertTrue('\t$f\n' in ''.join(indexbuff))
+
+    def testunknownnode(self,):
+        visitors = pycscope.Visitors()
+        visitors.onNode('no_such_node', lambda ctx, node: None)
+        pycscope.loadGrammar()
+        self.assertRaises(ValueError, visitors.nodeCallbacks)
+
+    def testplugin(self,):
+        orig_wd = os.getcwd()
+        os.chdir(self.tmpd)
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        try:
+            self.assertEqual(pycscope.main(['arg0', '--plugin=testvisitors', 'a.py']), 0)
+            self.assertEqual(pycscope.main(['arg0', '--plugin=no_such_plugin', 'a.py']), 1)
+        finally:
+            sys.path.pop(0)
+            os.chdir(orig_wd)
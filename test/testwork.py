@@ -30,3 +30,157 @@ class TestWork(unittest.TestCase):
             self.assertEquals(fbuf, ['a', 's', 'b'])
         finally:
             shutil.rmtree(tmpd)
+
+    def testworkdiskorder(self,):
+        tmpd = tempfile.mkdtemp()
+        try:
+            fnames = []
+            for i in range(10):
+                fname = 'f%d.py' % i
+                with open(os.path.join(tmpd, fname), "w") as f:
+                    f.write("f%d = 1\n" % i)
+                fnames.append(fname)
+            fnames.reverse()
+            fnames.append('_does_not_exist_.py')
+
+            order = pycscope.diskOrder(tmpd, fnames)
+            self.assertEqual(sorted(order), list(range(len(fnames))))
+
+            # Actual test
+            expected = pycscope.work(tmpd, fnames, False)
+            ret = pycscope.work(tmpd, iter(fnames), False, diskorder=True)
+            self.assertEqual(ret, expected)
+            ret = pycscope.work(tmpd, iter(fnames), False, prefetch=2, diskorder=True)
+            self.assertEqual(ret, expected)
+        finally:
+            shutil.rmtree(tmpd)
+
+    def testworkduplicates(self,):
+        tmpd = tempfile.mkdtemp()
+        try:
+            for fname in ('a', 'b', 'c'):
+                with open(os.path.join(tmpd, fname), "w") as f:
+                    f.write("b = 1\n" if fname == 'b' else "a = 1\n")
+            with open(os.path.join(tmpd, 's'), "w") as s:
+                s.write("a a (b)\n")
+
+            # Actual test
+            stats = pycscope.Stats()
+            ibuf, fbuf = pycscope.work(tmpd, ['a', 's', 'b', 'c', 'x'], False, stats=stats)
+            self.assertEquals(ibuf, ['\n\t@a\n\n', '1 \n\t=a\n = 1\n\n', '\n\t@s\n\n', '\n\t@b\n\n', '1 \n\t=b\n = 1\n\n',
+                                     '\n\t@c\n\n', '1 \n\t=a\n = 1\n\n'])
+            self.assertEquals(fbuf, ['a', 's', 'b', 'c'])
+            self.assertEquals((stats.files, stats.parsed, stats.duplicates, stats.duplicate_bytes, stats.errors),
+                              (4, 2, 1, 6, 2))
+
+            # Files are told apart by their bytes as read, and duplicates get
+            # the records of the first one
+            import hashlib
+            with open(os.path.join(tmpd, 'd'), "wb") as f:
+                f.write(b"import os\r\n")
+            with open(os.path.join(tmpd, 'e'), "wb") as f:
+                f.write(b"import os\r\n")
+            records = {}
+            pycscope.work(tmpd, ['a', 'c', 'd', 'e'], False, records=records)
+            self.assertEquals(records['c']['sha1'], hashlib.sha1(b"a = 1\n").hexdigest())
+            self.assertEquals(records['e'], {'sha1': hashlib.sha1(b"import os\r\n").hexdigest(),
+                                             'imports': [(1, 0, 'os', [])]})
+            self.assertEquals(pycscope.hashFile(tmpd, 'e'), records['e']['sha1'])
+        finally:
+            shutil.rmtree(tmpd)
+
+    def testworkmaxmemory(self,):
+        tmpd = tempfile.mkdtemp()
+        try:
+            fnames = []
+            for i in range(10):
+                fname = 'f%d.py' % i
+                with open(os.path.join(tmpd, fname), "w") as f:
+                    f.write("f%d = 1\n" % (i % 5))
+                fnames.append(fname)
+
+            # Actual test
+            ibuf, fbuf = pycscope.work(tmpd, fnames, False)
+            stats = pycscope.Stats()
+            ret, fret = pycscope.work(tmpd, fnames, False, stats=stats, maxmemory=64)
+            self.assertTrue(isinstance(ret, pycscope.IndexBuffer))
+            self.assertTrue(ret.spill is not None)
+            self.assertTrue(ret.size <= 32 + len(max(ibuf, key=len)))
+            self.assertEquals(b''.join(ret), ''.join(ibuf))
+            self.assertEquals(fret, fbuf)
+            # Only two of the five distinct files fit in the contents cache
+            self.assertEquals((stats.parsed, stats.duplicates), (8, 2))
+
+            # What is cached for the sinks counts too
+            ctx = pycscope.Context(keep=True)
+            pycscope.parseSource("a = f(1)\n", [], 0, ctx=ctx)
+            self.assertTrue(pycscope.cacheSize(ctx) > 8 * len(''.join(ctx.buff)))
+            stats = pycscope.Stats()
+            sink = pycscope.TagsWriter(os.path.join(tmpd, 'tags'))
+            pycscope.work(tmpd, fnames, False, [sink], stats=stats, maxmemory=64)[0].close()
+            sink.close()
+            self.assertEquals((stats.parsed, stats.duplicates), (10, 0))
+
+            expected = StringIO()
+            pycscope.writeIndex(tmpd, expected, ibuf, fbuf)
+            fout = StringIO()
+            pycscope.writeIndex(tmpd, fout, ret, fret)
+            self.assertEquals(fout.getvalue(), expected.getvalue())
+            ret.close()
+        finally:
+            shutil.rmtree(tmpd)
+
+    def testworkevents(self,):
+        import json
+        tmpd = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmpd, 'a'), "w") as a:
+                a.write("a = 1\n")
+            with open(os.path.join(tmpd, 's'), "w") as s:
+                s.write("a a (b)\n")
+            eventsfn = os.path.join(tmpd, 'events')
+            events = pycscope.EventWriter(eventsfn)
+            progress = pycscope.Progress(StringIO(), total=3, interval=0)
+            pycscope.work(tmpd, ['a', 's', 'x'], False, events=[events, progress])
+            events.close()
+
+            with open(eventsfn) as f:
+                ret = [json.loads(line) for line in f]
+            self.assertEqual([(e['event'], e.get('file')) for e in ret],
+                             [('start', 'a'), ('finish', 'a'), ('start', 's'), ('error', 's'),
+                              ('start', 'x'), ('error', 'x'), ('end', None)])
+            self.assertEqual((ret[1]['bytes'], ret[1]['index_bytes']), (6, len('\n\t@a\n\n1 \n\t=a\n = 1\n\n')))
+            self.assertTrue(ret[3]['message'].startswith('Line 1: '))
+            self.assertEqual((ret[-1]['files'], ret[-1]['errors']), (3, 2))
+
+            self.assertEqual(progress.done, 3)
+            self.assertTrue(progress.format(progress.start + 2).startswith('3/3 files, 0 left, 1.5 files/s, '))
+            self.assertTrue(progress.stream.getvalue().startswith('\rpycscope.py: 1/3 files, 2 left, '))
+        finally:
+            shutil.rmtree(tmpd)
+
+    def testworkeventsstdout(self,):
+        import json, sys
+        tmpd = tempfile.mkdtemp()
+        orig = os.getcwd(), sys.stdout, sys.stderr
+        try:
+            with open(os.path.join(tmpd, 's.py'), "w") as s:
+                s.write("a a (b)\n")
+            with open(os.path.join(tmpd, 'a.py'), "w") as a:
+                a.write("a = 1\n")
+            os.chdir(tmpd)
+            sys.stdout, sys.stderr = StringIO(), StringIO()
+            pycscope.main(['arg0', '--events=-', 's.py', 'a.py', 'x.py'])
+            out, err = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            os.chdir(orig[0])
+            sys.stdout, sys.stderr = orig[1:]
+            pycscope.diagnose_to_stderr = False
+            shutil.rmtree(tmpd)
+
+        # Only the events go to standard output, the diagnostics to standard
+        # error
+        ret = [json.loads(line) for line in out.splitlines()]
+        self.assertEqual([e['event'] for e in ret], ['start', 'error', 'start', 'finish', 'start', 'error', 'end'])
+        self.assertTrue('s.py: Line 1: ' in err)
+        self.assertTrue('x.py' in err)
@@ -3,6 +3,8 @@
 """
 
 import unittest
+import os
+import tempfile
 from cStringIO import StringIO
 import pycscope
 
@@ -13,3 +15,24 @@ class TestWriteIndex(unittest.TestCase):
         fout = StringIO()
         pycscope.writeIndex("/tmp/foo/bar", fout, ['mockline1','mockline2'], ["fname1","fname2"])
         self.assertEquals("cscope 15 /tmp/foo/bar -c 0000000055mockline1mockline2\n1\n.\n0\n2\n14\nfname1\nfname2\n", fout.getvalue())
+
+    def testbyteoffsets(self,):
+        fout = StringIO()
+        pycscope.writeIndex("/tmp", fout, [u'caf\xe9'], [u'\xe9.py'])
+        self.assertEquals("cscope 15 /tmp -c 0000000034caf\xc3\xa9\n1\n.\n0\n1\n6\n\xc3\xa9.py\n", fout.getvalue())
+
+    def testnotseekable(self,):
+        rfd, wfd = os.pipe()
+        with os.fdopen(wfd, 'wb') as fout:
+            pycscope.writeIndex("/tmp/foo/bar", fout, ['mockline1','mockline2'], ["fname1","fname2"])
+        with os.fdopen(rfd, 'rb') as fin:
+            self.assertEquals(b"cscope 15 /tmp/foo/bar -c 0000000055mockline1mockline2\n1\n.\n0\n2\n14\nfname1\nfname2\n", fin.read())
+
+    def testblocks(self,):
+        lines = ['line%d' % i for i in range(10000)]
+        with tempfile.TemporaryFile() as fout:
+            pycscope.writeIndex("/tmp", fout, lines, ["fname"])
+            fout.seek(0)
+            ret = fout.read()
+        index = ''.join(lines)
+        self.assertEquals(ret, b"cscope 15 /tmp -c %010d%s\n1\n.\n0\n1\n6\nfname\n" % (29 + len(index), index))